@@ -80,6 +80,40 @@ Writen(int fd, void *ptr, size_t nbytes)
 		err_sys("writen error");
 }
 
+ssize_t						/* Write all iovec buffers to a descriptor. */
+writevn(int fd, struct iovec *iov, int iovcnt)
+{
+	size_t		nleft, n;
+	ssize_t		nwritten;
+	int			i;
+
+	nleft = 0;
+	for (i = 0; i < iovcnt; i++)
+		nleft += iov[i].iov_len;
+	n = nleft;
+	while (nleft > 0) {
+		if ( (nwritten = writev(fd, iov, iovcnt)) <= 0) {
+			if (nwritten < 0 && errno == EINTR)
+				nwritten = 0;		/* and call writev() again */
+			else
+				return(-1);			/* error */
+		}
+
+		nleft -= nwritten;
+		while (iovcnt > 0 && (size_t) nwritten >= iov->iov_len) {
+			nwritten -= iov->iov_len;	/* skip written buffers */
+			iov++;
+			iovcnt--;
+		}
+		if (nwritten > 0) {
+			iov->iov_base = (char *) iov->iov_base + nwritten;
+			iov->iov_len -= nwritten;
+		}
+	}
+	return(n);
+}
+/* end writevn, iov is modified */
+
 
 
 static void	err_doit(int, int, const char *, va_list);
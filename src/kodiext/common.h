@@ -1,4 +1,5 @@
 #include <stdio.h>
+#include <sys/uio.h>
 
 #ifndef _COMMON_H_
 #define _COMMON_H_
@@ -15,5 +16,6 @@ ssize_t readn(int fd, void *vptr, size_t n);
 ssize_t Readn(int fd, void *ptr, size_t nbytes);
 ssize_t writen(int fd, const void *vptr, size_t n);
 void Writen(int fd, void *ptr, size_t nbytes);
+ssize_t writevn(int fd, struct iovec *iov, int iovcnt);
 
 #endif
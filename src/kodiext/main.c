@@ -10,11 +10,22 @@
 #include <sys/types.h>
 #include <time.h>
 #include <getopt.h>
+#include <signal.h>
+#include <sys/uio.h>
+#include <sys/time.h>
+#include <sys/wait.h>
+#include <fcntl.h>
+#include <spawn.h>
+#include <errno.h>
 
 #include "common.h"
 #include "packet.h"
 #include "dvbaudio.h"
 
+#define PLAYING_LOCK "/tmp/playing.lock"
+
+extern char **environ;
+
 enum
 {
   OP_CODE_EXIT,
@@ -23,6 +34,9 @@ enum
   OP_CODE_PLAY_STOP,
   OP_CODE_SWITCH_TO_ENIGMA2,
   OP_CODE_SWITCH_TO_KODI,
+  OP_CODE_PLAY_STATUS_SUBSCRIBE,
+  OP_CODE_STATS,
+  OP_CODE_PREFETCH,
 };
 
 static const char *opcode_to_str(int opcode)
@@ -48,6 +62,15 @@ static const char *opcode_to_str(int opcode)
     case OP_CODE_SWITCH_TO_KODI:
       opcode_str = "OP_CODE_SWITCH_TO_KODI";
       break;
+    case OP_CODE_PLAY_STATUS_SUBSCRIBE:
+      opcode_str = "OP_CODE_PLAY_STATUS_SUBSCRIBE";
+      break;
+    case OP_CODE_STATS:
+      opcode_str = "OP_CODE_STATS";
+      break;
+    case OP_CODE_PREFETCH:
+      opcode_str = "OP_CODE_PREFETCH";
+      break;
     default:
       opcode_str = "OP_CODE_UKNOWN";
       break;
@@ -63,38 +86,176 @@ static char *packet_to_str(const struct packet_header *ph, char *packet_str)
   return packet_str;
 }
 
-static void send_message(struct packet_header *ph, char *datain, char **dataout)
+static int server_fd = -1;
+
+static void server_connect(void)
 {
-  char packet_str[128];
-  int sockfd;
   struct sockaddr_un servaddr;
 
-  if ((sockfd = socket(AF_LOCAL, SOCK_STREAM, 0)) < 0)
+  if ((server_fd = socket(AF_LOCAL, SOCK_STREAM, 0)) < 0)
     err_sys("socket_error");
 
   bzero(&servaddr, sizeof(servaddr));
   servaddr.sun_family = AF_LOCAL;
   strcpy(servaddr.sun_path, "/tmp/kodiext.socket");
 
-  if (connect(sockfd, (struct sockaddr *) &servaddr, sizeof(servaddr)) < 0)
+  if (connect(server_fd, (struct sockaddr *) &servaddr, sizeof(servaddr)) < 0)
     err_sys("connect_error");
+}
 
-  //fprintf(stderr,"sent %s\n", packet_to_str(ph, packet_str));
-  Writen(sockfd, ph , sizeof(*ph));
-  Writen(sockfd, datain , ph->length);
-  Readn(sockfd, ph, sizeof(*ph));
+static void server_disconnect(void)
+{
+  if (server_fd < 0)
+    return;
+  if (close(server_fd) < 0)
+    err_sys("close_error");
+  server_fd = -1;
+}
+
+/* Write one request to the session connection, several requests may be
+ * written before their replies are read. Header and data are written with
+ * a single writev(). Returns -1 if the connection was closed by the server. */
+static int write_request(struct packet_header *ph, const char *datain)
+{
+  static unsigned int request_id = 0;
+  unsigned char header[PACKET_HEADER_SIZE];
+  struct iovec iov[2];
+  int iovcnt = 1;
+
+  ph->version = PACKET_VERSION;
+  ph->flags = 0;
+  ph->id = ++request_id;
+  packet_header_pack(ph, header);
+  iov[0].iov_base = header;
+  iov[0].iov_len = sizeof(header);
+  if (ph->length > 0)
+  {
+    iov[1].iov_base = (void *) datain;
+    iov[1].iov_len = ph->length;
+    iovcnt = 2;
+  }
+  if (writevn(server_fd, iov, iovcnt) != sizeof(header) + ph->length)
+    return -1;
+  return 0;
+}
+
+/* Read the reply to the oldest outstanding request. Data is read straight
+ * into the returned buffer. Returns -1 if the connection was closed by the
+ * server. */
+static int read_reply(struct packet_header *ph, char **dataout)
+{
+  unsigned char header[PACKET_HEADER_SIZE];
+  ssize_t n;
+
+  if ((n = readn(server_fd, header, sizeof(header))) != sizeof(header))
+    return -1;
+  /* plugins older than protocol version 2 don't answer v2 requests at all,
+   * anything else than a v2 reply means plugin and kodiext don't match */
+  if (packet_header_unpack(ph, header) < 0)
+    err_quit("reply without protocol header, the Kodi plugin doesn't match this kodiext");
+  if (ph->version != PACKET_VERSION)
+    err_quit("reply in protocol version %d, kodiext needs version %d of the Kodi plugin",
+             ph->version, PACKET_VERSION);
   if (ph->length > 0 && dataout != NULL)
   {
     *dataout = (char *) malloc(ph->length * sizeof(char) + 1);
-    Readn(sockfd, *dataout, ph->length);
+    if (Readn(server_fd, *dataout, ph->length) != ph->length)
+    {
+      free(*dataout);
+      *dataout = NULL;
+      return -1;
+    }
     *(*dataout + ph->length) = '\0';
   }
+  else if (ph->length > 0)
+  {
+    char discard[256];
+    size_t left = ph->length;
+    while (left > 0)
+    {
+      n = Readn(server_fd, discard, left < sizeof(discard) ? left : sizeof(discard));
+      if (n == 0)
+        return -1;
+      left -= n;
+    }
+  }
+  return 0;
+}
+
+static void send_message(struct packet_header *ph, char *datain, char **dataout)
+{
+  char packet_str[128];
+  struct packet_header request = *ph;
+
+  if (server_fd < 0)
+    server_connect();
+
+  //fprintf(stderr,"sent %s\n", packet_to_str(ph, packet_str));
+  if (write_request(ph, datain) < 0 || read_reply(ph, dataout) < 0)
+  {
+    /* the server closed the session connection before answering, e.g. the
+     * plugin was restarted, so reconnect and send the request again */
+    *ph = request;
+    server_disconnect();
+    server_connect();
+    if (write_request(ph, datain) < 0 || read_reply(ph, dataout) < 0)
+      err_quit("connection to server lost");
+  }
   //fprintf(stderr, "received %s\n", packet_to_str(ph, packet_str));
+}
 
-  if (close(sockfd) < 0)
-    err_sys("close_error");
+
+static double elapsed_ms(const struct timeval *start)
+{
+  struct timeval now;
+  gettimeofday(&now, NULL);
+  return (now.tv_sec - start->tv_sec) * 1000.0 + (now.tv_usec - start->tv_usec) / 1000.0;
 }
 
+/* starts "config -pid <pid> -visible <visible>" without a shell,
+ * returns its pid or -1 */
+static pid_t config_spawn(const char *pid, const char *visible, struct timeval *started)
+{
+  char *argv[] = {"config", "-pid", (char *) pid, "-visible", (char *) visible, NULL};
+  pid_t child;
+  int err;
+
+  gettimeofday(started, NULL);
+  if ((err = posix_spawnp(&child, argv[0], NULL, NULL, argv, environ)) != 0)
+  {
+    fprintf(stderr, "cannot run config: %s\n", strerror(err));
+    return -1;
+  }
+  fprintf(stderr, "config -visible %s: spawned in %.1f ms\n", visible, elapsed_ms(started));
+  return child;
+}
+
+/* reaps the config child, with nohang only if it has already exited,
+ * returns 1 once it's reaped */
+static int config_reap(pid_t child, const char *visible, const struct timeval *started, int nohang)
+{
+  int status;
+  pid_t ret;
+
+  while ((ret = waitpid(child, &status, nohang ? WNOHANG : 0)) < 0 && errno == EINTR)
+    ;
+  if (ret == 0)
+    return 0;
+  if (ret < 0)
+    err_ret("waitpid error");
+  else
+    fprintf(stderr, "config -visible %s: exited with %d after %.1f ms\n", visible,
+            WIFEXITED(status) ? WEXITSTATUS(status) : -1, elapsed_ms(started));
+  return 1;
+}
+
+static void config_visible(const char *pid, const char *visible)
+{
+  struct timeval started;
+  pid_t child = config_spawn(pid, visible, &started);
+  if (child > 0)
+    config_reap(child, visible, &started, 0);
+}
 
 int main(int argc, char **argv)
 {
@@ -102,13 +263,17 @@ int main(int argc, char **argv)
   char *surl = NULL;
   char *pid = NULL;
   char *stype = "4097";
+  char *interval = "1000";
+  char *prefetch = NULL;
+  size_t prefetchlen = 0;
   int stop = 0;
+  int stats = 0;
   int tokodi = 0;
   int toenigma2 = 0;
   int c;
   opterr = 0;
 
-  while ((c = getopt (argc, argv, "U:P:S:X:TEK")) != -1)
+  while ((c = getopt (argc, argv, "U:P:S:X:I:F:TEKs")) != -1)
     switch (c)
       {
       case 'U':
@@ -120,9 +285,25 @@ int main(int argc, char **argv)
       case 'X':
         stype = optarg;
         break;
+      case 'I':
+        interval = optarg;
+        break;
+      case 'F':
+        /* artwork urls to prefetch, one per line */
+        prefetch = realloc(prefetch, prefetchlen + strlen(optarg) + 2);
+        if (prefetch == NULL)
+          err_sys("realloc error");
+        if (prefetchlen > 0)
+          prefetch[prefetchlen++] = '\n';
+        strcpy(prefetch + prefetchlen, optarg);
+        prefetchlen += strlen(optarg);
+        break;
       case 'T':
         stop = 1;
         break;
+      case 's':
+        stats = 1;
+        break;
       case 'E':
         toenigma2 = 1;
         break;
@@ -133,7 +314,7 @@ int main(int argc, char **argv)
         pid = optarg;
         break;
       case '?':
-        if (optopt == 'U' || optopt == 'P' || optopt == 'S' || optopt == 'X')
+        if (optopt == 'U' || optopt == 'P' || optopt == 'S' || optopt == 'X' || optopt == 'I' || optopt == 'F')
           fprintf (stderr, "Option -%c requires an argument.\n", optopt);
         else if (isprint (optopt))
           fprintf (stderr, "Unknown option `-%c'.\n", optopt);
@@ -146,18 +327,56 @@ int main(int argc, char **argv)
         abort ();
       }
 
-  if (!(stop || ((tokodi || toenigma2) && pid != NULL) || (purl != NULL && pid != NULL)))
+  if (!(stop || stats || prefetch != NULL || ((tokodi || toenigma2) && pid != NULL) || (purl != NULL && pid != NULL)))
   {
-    fprintf(stderr, "Usage: kodiext -U playurl -P ppid [-S subtitlesurl] [-X servicetype] [-T] [-E] [-K]\n");
+    fprintf(stderr, "Usage: kodiext -U playurl -P ppid [-S subtitlesurl] [-X servicetype] [-I statusinterval] [-F artworkurl]... [-T] [-E] [-K] [-s]\n");
     return 1;
   }
 
   fprintf(stderr, "playurl = %s, subtitlesurl = %s, servicetype = %s, stop = %d, toenigma2 = %d, tokodi = %d\n", 
           purl, surl, stype, stop, toenigma2, tokodi);
 
+  /* a closed session connection is reported by write(), not by a signal */
+  signal(SIGPIPE, SIG_IGN);
+
   struct packet_header ph;
-  char configcmd[64];
   char *data = NULL;
+  pid_t config_pid;
+  struct timeval config_started;
+  int fd;
+
+  if (stats)
+  {
+    ph.opcode = OP_CODE_STATS;
+    ph.result = 0;
+    ph.length = 0;
+    send_message(&ph, data, &data);
+    if (!ph.result || data == NULL)
+    {
+      fprintf(stderr, "cannot get stats!\n");
+      return 2;
+    }
+    fputs(data, stdout);
+    fputc('\n', stdout);
+    free(data);
+    return 0;
+  }
+
+  if (prefetch != NULL)
+  {
+    ph.opcode = OP_CODE_PREFETCH;
+    ph.result = 0;
+    ph.length = prefetchlen;
+    send_message(&ph, prefetch, NULL);
+    free(prefetch);
+    if (!ph.result)
+    {
+      fprintf(stderr, "cannot prefetch artwork!\n");
+      return 2;
+    }
+    if (purl == NULL && !(stop || stats || tokodi || toenigma2))
+      return 0;
+  }
 
   if (stop)
   {
@@ -184,8 +403,8 @@ int main(int argc, char **argv)
       fprintf(stderr, "cannot switch to enigma2!\n");
       return 2;
     }
-    sprintf(configcmd, "config -pid %s -visible off", pid);
-    system(configcmd);
+    /* done before exiting, enigma2 takes over once the connection is closed */
+    config_visible(pid, "off");
 
     return 0;
   }
@@ -202,8 +421,7 @@ int main(int argc, char **argv)
       return 2;
     }
     audioSetBypassToRaw();
-    sprintf(configcmd, "config -pid %s -visible on", pid);
-    system(configcmd);
+    config_visible(pid, "on");
     return 0;
   }
 
@@ -228,27 +446,50 @@ int main(int argc, char **argv)
     return 3;
   }
 
-  sprintf(configcmd, "config -pid %s -visible off", pid);
-  system(configcmd);
-  system("touch /tmp/playing.lock 2>/dev/null");
+  /* Kodi is hidden while the status loop runs, the child is reaped there */
+  config_pid = config_spawn(pid, "off", &config_started);
+  if ((fd = open(PLAYING_LOCK, O_WRONLY | O_CREAT | O_TRUNC, 0644)) >= 0)
+    close(fd);
 
+  /* the server pushes a status frame on every play state change and
+   * every interval ms, until the player is closed (ph.result == 0) */
   char *dataout = NULL;
-  while(ph.result)
+  int subscribed = 0;
+  while (1)
   {
-    sleep(1);
+    if (!subscribed)
+    {
+      ph.opcode = OP_CODE_PLAY_STATUS_SUBSCRIBE;
+      ph.result = 0;
+      ph.length = strlen(interval);
+      send_message(&ph, interval, &dataout);
+      subscribed = 1;
+    }
+    else if (read_reply(&ph, &dataout) < 0)
+      err_quit("connection to server lost");
 
-    ph.opcode = OP_CODE_PLAY_STATUS;
-    ph.result = 0;
-    ph.length = 0;
-    send_message(&ph, data, &dataout);
-    if (dataout != NULL)
+    if (ph.flags & PACKET_FLAG_ERROR)
+    {
+      /* the server gave up on the subscription, subscribe again */
+      fprintf(stderr, "status subscription failed: %s\n", dataout != NULL ? dataout : "");
+      subscribed = 0;
+      sleep(1);
+    }
+    else if (dataout != NULL)
     {
       fputs(dataout, stdout);
       fputc('\n', stdout);
       fflush(stdout);
+    }
+    if (dataout != NULL)
+    {
       free(dataout);
       dataout = NULL;
     }
+    if (config_pid > 0 && config_reap(config_pid, "off", &config_started, 1))
+      config_pid = -1;
+    if (subscribed && !ph.result)
+      break;
   }
 
   ph.opcode = OP_CODE_PLAY_STOP;
@@ -263,8 +504,10 @@ int main(int argc, char **argv)
   }
 
   audioSetBypassToRaw();
-  sprintf(configcmd, "config -pid %s -visible on", pid);
-  system(configcmd);
-  system("rm /tmp/playing.lock 2>/dev/null");
+  /* hiding has to be done before Kodi is shown again */
+  if (config_pid > 0)
+    config_reap(config_pid, "off", &config_started, 0);
+  config_visible(pid, "on");
+  unlink(PLAYING_LOCK);
   return 0;
 }
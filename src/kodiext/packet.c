@@ -0,0 +1,41 @@
+#include <string.h>
+
+#include "packet.h"
+
+static void put_le32(unsigned char *buf, unsigned int val)
+{
+  buf[0] = val & 0xff;
+  buf[1] = (val >> 8) & 0xff;
+  buf[2] = (val >> 16) & 0xff;
+  buf[3] = (val >> 24) & 0xff;
+}
+
+static unsigned int get_le32(const unsigned char *buf)
+{
+  return buf[0] | (buf[1] << 8) | (buf[2] << 16) | ((unsigned int) buf[3] << 24);
+}
+
+void packet_header_pack(const struct packet_header *ph, unsigned char *buf)
+{
+  memcpy(buf, PACKET_MAGIC, 4);
+  buf[4] = ph->version;
+  buf[5] = ph->opcode;
+  buf[6] = (unsigned char) ph->result;
+  buf[7] = ph->flags;
+  put_le32(buf + 8, ph->length);
+  put_le32(buf + 12, ph->id);
+}
+
+/* Returns -1 if buf doesn't hold a version 2 header */
+int packet_header_unpack(struct packet_header *ph, const unsigned char *buf)
+{
+  if (memcmp(buf, PACKET_MAGIC, 4) != 0)
+    return -1;
+  ph->version = buf[4];
+  ph->opcode = buf[5];
+  ph->result = (signed char) buf[6];
+  ph->flags = buf[7];
+  ph->length = get_le32(buf + 8);
+  ph->id = get_le32(buf + 12);
+  return 0;
+}
@@ -1,6 +1,26 @@
+#ifndef _PACKET_H_
+#define _PACKET_H_
+
+/* Protocol version 2 wire header, fixed little-endian layout:
+ * magic[4], version, opcode, result, flags, length (u32), id (u32) */
+#define PACKET_MAGIC "KEXT"
+#define PACKET_VERSION 2
+#define PACKET_HEADER_SIZE 16
+
+/* reply flags */
+#define PACKET_FLAG_ERROR 0x01
+
 struct packet_header
 {
   int opcode;
   signed char result;
   int length;
-};
\ No newline at end of file
+  unsigned char version;
+  unsigned char flags;
+  unsigned int id;
+};
+
+void packet_header_pack(const struct packet_header *ph, unsigned char *buf);
+int packet_header_unpack(struct packet_header *ph, const unsigned char *buf);
+
+#endif
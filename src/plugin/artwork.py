@@ -0,0 +1,481 @@
+# -*- coding: UTF-8 -*-
+from collections import OrderedDict
+import hashlib
+import itertools
+import json
+import os
+import re
+import time
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import failure
+
+ARTWORK_CACHE_DIR = "/tmp/kodi_artwork/"
+ARTWORK_CACHE_MAX_BYTES = 20 * 1024 * 1024
+ARTWORK_CACHE_MAX_ENTRIES = 500
+# cached artwork older than this is revalidated with the server
+ARTWORK_CACHE_MAX_AGE = 24 * 60 * 60
+ARTWORK_MAX_DOWNLOADS = 2
+# seconds to connect and to complete a transfer, a stalled server
+# mustn't hold a download slot forever
+ARTWORK_CONNECT_TIMEOUT = 10
+ARTWORK_DOWNLOAD_TIMEOUT = 30
+PIXMAP_CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+
+# PIL and twisted.web are imported on first use, not with the plugin
+Image = None
+PIL_IMPORTED = False
+
+
+def loadPIL():
+    """Returns the PIL Image module, None if PIL isn't installed"""
+    global Image, PIL_IMPORTED
+    if not PIL_IMPORTED:
+        PIL_IMPORTED = True
+        try:
+            from PIL import Image
+        except ImportError:
+            print '[ArtworkCache] PIL is not installed, artwork is not scaled down'
+            Image = None
+    return Image
+
+
+def toBytes(text):
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return str(text)
+
+
+def scaleImage(path, sizes, suffix):
+    """
+    Writes copies of image path scaled down to fit into each of sizes,
+    named "path.WxH" + suffix, returns [width, height, file size] of the
+    written ones
+    """
+    variants = []
+    for width, height in sizes:
+        variantPath = "%s.%dx%d%s" % (path, width, height, suffix)
+        try:
+            image = Image.open(path)
+            if image.size[0] <= width and image.size[1] <= height:
+                continue
+            # lets JPEG decode at a fraction of the full resolution
+            image.draft('RGB', (width, height))
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                fmt = 'PNG'
+            else:
+                image = image.convert('RGB')
+                fmt = 'JPEG'
+            image.thumbnail((width, height), Image.ANTIALIAS)
+            image.save(variantPath, fmt, quality=90)
+            variants.append([width, height, os.path.getsize(variantPath)])
+        except Exception as e:
+            print '[ArtworkCache] cannot scale "%s" to %dx%d: %s' % (path, width, height, str(e))
+            try:
+                os.remove(variantPath)
+            except OSError:
+                pass
+    return variants
+
+
+class ArtworkCache(object):
+    """
+    Bounded on-disk cache of downloaded artwork with LRU eviction
+
+    Files are named by the sha1 of their url and are renamed into place
+    only once completely written. The cached files are tracked in memory
+    and in a persistent index, so a hit needs no stat call. The index
+    also keeps the ETag and Last-Modified validators of each file.
+
+    With PIL available, copies scaled down to variantSizes are stored
+    next to each file, so widgets of those sizes don't have to decode
+    and scale the full size artwork.
+    """
+    INDEX_FILE = "index.json"
+    INDEX_VERSION = 3
+    # names of the files created by the cache: sha1 key, optionally with
+    # variant size, temp files with a ".N.part" or ".part" suffix
+    FILE_NAME = re.compile(r"^[0-9a-f]{40}(\.\d+x\d+)?(\.\d+)?(\.part)?$")
+
+    def __init__(self, cachedir=ARTWORK_CACHE_DIR, maxBytes=ARTWORK_CACHE_MAX_BYTES, maxEntries=ARTWORK_CACHE_MAX_ENTRIES, maxAge=ARTWORK_CACHE_MAX_AGE, variantSizes=()):
+        self.cachedir = cachedir
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        self.maxAge = maxAge
+        self.variantSizes = [tuple(size) for size in variantSizes]
+        # key -> [size in bytes including variants, fetch time, etag,
+        # last modified, [[width, height, size in bytes] of variants]],
+        # least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.tmpIds = itertools.count()
+        # key -> deferreds waiting for its variants being created
+        self.scaling = {}
+        self.loadIndex()
+
+    def key(self, url):
+        return hashlib.sha1(toBytes(url)).hexdigest()
+
+    def path(self, key, size=None):
+        if size is not None:
+            key = "%s.%dx%d" % (key, size[0], size[1])
+        return os.path.join(self.cachedir, key)
+
+    def get(self, url, fresh=False, size=None):
+        """Returns path of the cached url or None, with fresh=True
+        only if it doesn't need to be revalidated yet, with size
+        (width, height) the path of the variant of that size if any"""
+        key = self.key(url)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        self.entries[key] = entry
+        if fresh and time.time() - entry[1] > self.maxAge:
+            return None
+        if size is not None:
+            for width, height, variantSize in entry[4]:
+                if (width, height) == tuple(size):
+                    return self.path(key, size)
+        return self.path(key)
+
+    def validators(self, url):
+        """Returns (etag, last modified) of the cached url"""
+        entry = self.entries.get(self.key(url))
+        if entry is None:
+            return None, None
+        return entry[2], entry[3]
+
+    def tempPath(self, url):
+        """Returns unique path to download url to before insert()"""
+        return "%s.%d.part" % (self.path(self.key(url)), next(self.tmpIds))
+
+    def insert(self, url, tmpPath, etag=None, lastModified=None):
+        """Moves completely written tmpPath into the cache, returns its new path"""
+        key = self.key(url)
+        path = self.path(key)
+        size = os.path.getsize(tmpPath)
+        os.rename(tmpPath, path)
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[0]
+            self.removeVariants(key, old)
+        self.entries[key] = [size, time.time(), etag, lastModified, []]
+        self.size += size
+        self.evict()
+        self.saveIndex()
+        return path
+
+    def createVariants(self, url):
+        """Returns deferred firing once the variants of the cached url are written"""
+        key = self.key(url)
+        entry = self.entries.get(key)
+        if entry is None or not self.variantSizes or loadPIL() is None:
+            return defer.succeed(None)
+        # written next to the original as temp files, they're renamed
+        # into place only if the original is still the cached one
+        suffix = ".%d.part" % next(self.tmpIds)
+        self.scaling.setdefault(key, [])
+        d = threads.deferToThread(scaleImage, self.path(key), self.variantSizes, suffix)
+        d.addCallback(self.addVariants, key, entry, suffix)
+        d.addBoth(self.scalingDone, key)
+        return d
+
+    def whenScaled(self, url):
+        """Returns deferred firing once the variants of url which are
+        being created are written, at once if there are none"""
+        d = defer.Deferred()
+        waiting = self.scaling.get(self.key(url))
+        if waiting is None:
+            d.callback(None)
+        else:
+            waiting.append(d)
+        return d
+
+    def scalingDone(self, result, key):
+        for d in self.scaling.pop(key, []):
+            d.callback(None)
+        return result
+
+    def addVariants(self, variants, key, entry, suffix):
+        # the file may have been evicted or replaced in the meantime
+        current = self.entries.get(key) is entry
+        added = []
+        for variant in variants:
+            path = self.path(key, variant[:2])
+            try:
+                if current:
+                    os.rename(path + suffix, path)
+                    added.append(variant)
+                else:
+                    os.remove(path + suffix)
+            except OSError as e:
+                print '[ArtworkCache] cannot store variant "%s": %s' % (path, str(e))
+        if not current:
+            return
+        entry[4] = added
+        size = sum(variant[2] for variant in added)
+        entry[0] += size
+        self.size += size
+        self.evict()
+        self.saveIndex()
+
+    def removeVariants(self, key, entry):
+        for width, height, size in entry[4]:
+            try:
+                os.remove(self.path(key, (width, height)))
+            except OSError:
+                pass
+
+    def revalidated(self, url):
+        """Marks the cached url as still valid, returns its path or None"""
+        key = self.key(url)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        entry[1] = time.time()
+        self.entries[key] = entry
+        self.saveIndex()
+        return self.path(key)
+
+    def evict(self):
+        # the newest entry stays even if it's over the limits alone
+        while len(self.entries) > 1 and (self.size > self.maxBytes or len(self.entries) > self.maxEntries):
+            key, entry = self.entries.popitem(last=False)
+            self.size -= entry[0]
+            self.removeVariants(key, entry)
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def loadIndex(self):
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            names = set(os.listdir(self.cachedir))
+        except OSError as e:
+            print '[ArtworkCache] cannot use cache directory "%s": %s' % (self.cachedir, str(e))
+            return
+        try:
+            index = json.load(open(os.path.join(self.cachedir, self.INDEX_FILE), "r"))
+            if index.get("version") != self.INDEX_VERSION:
+                raise ValueError("unsupported index version")
+            entries = index["entries"]
+        except Exception:
+            entries = []
+        known = set([self.INDEX_FILE])
+        for key, entry in entries:
+            key = str(key)
+            if key in names:
+                variants = []
+                for variant in entry[4]:
+                    name = os.path.basename(self.path(key, variant[:2]))
+                    if name in names:
+                        variants.append(variant)
+                        known.add(name)
+                    else:
+                        entry[0] -= variant[2]
+                entry[4] = variants
+                self.entries[key] = entry
+                self.size += entry[0]
+                known.add(key)
+        # drop partial downloads and files missing in the index, the
+        # directory is configurable, so leave alone any other files in it
+        for name in names.difference(known):
+            if not self.FILE_NAME.match(name) and name != self.INDEX_FILE + ".part":
+                continue
+            try:
+                os.remove(os.path.join(self.cachedir, name))
+            except OSError:
+                pass
+        self.evict()
+
+    def saveIndex(self):
+        path = os.path.join(self.cachedir, self.INDEX_FILE)
+        try:
+            with open(path + ".part", "w") as f:
+                json.dump({"version": self.INDEX_VERSION, "entries": self.entries.items()}, f)
+            os.rename(path + ".part", path)
+        except (IOError, OSError) as e:
+            print '[ArtworkCache] failed to save index: %s' % str(e)
+
+
+class PixmapCache(object):
+    """
+    LRU cache of decoded pixmaps with a memory cap
+
+    Keys are (source, width, height, aspect...) of the decode, values
+    the ePicLoad.getData() results, size is estimated as 32bpp.
+    """
+
+    def __init__(self, maxBytes=PIXMAP_CACHE_MAX_BYTES):
+        self.maxBytes = maxBytes
+        # key -> (ptr, size in bytes), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        self.entries[key] = entry
+        return entry[0]
+
+    def put(self, key, ptr):
+        size = key[1] * key[2] * 4
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        if size > self.maxBytes:
+            return
+        self.entries[key] = (ptr, size)
+        self.size += size
+        while self.size > self.maxBytes:
+            key, (ptr, size) = self.entries.popitem(last=False)
+            self.size -= size
+
+
+class ArtworkDownloader(object):
+    """
+    Downloads artwork into an ArtworkCache
+
+    Concurrent fetches of the same url share one transfer and at most
+    maxDownloads transfers run at once. Already cached urls are fetched
+    with a conditional request, so unchanged artwork isn't transferred
+    again and the cached file is used if the server can't be reached.
+    """
+    AGENT = "Mozilla/5.0 (Windows; U; Windows NT 5.1; de; rv:1.9.0.2) Gecko/2008091620 Firefox/3.0.2"
+
+    def __init__(self, cache, maxDownloads=ARTWORK_MAX_DOWNLOADS):
+        self.cache = cache
+        # image hosts and CDNs often redirect to the actual file
+        from twisted.web.client import Agent, BrowserLikeRedirectAgent
+        self.agent = BrowserLikeRedirectAgent(Agent(reactor, connectTimeout=ARTWORK_CONNECT_TIMEOUT))
+        self.semaphore = defer.DeferredSemaphore(maxDownloads)
+        # url -> deferreds waiting for its transfer
+        self.pending = {}
+
+    def fetch(self, url, size=None):
+        """Returns deferred firing with the path of the cached url, with
+        size (width, height) with the path of its variant of that size
+        if there's one, once the variants being created are written"""
+        url = toBytes(url)
+        d = defer.Deferred()
+        if size is not None:
+            d.addCallback(self.getVariant, url, size)
+        waiting = self.pending.get(url)
+        if waiting is not None:
+            waiting.append(d)
+            return d
+        self.pending[url] = [d]
+        self.semaphore.run(self.download, url).addBoth(self.downloadDone, url)
+        return d
+
+    def getVariant(self, path, url, size):
+        d = self.cache.whenScaled(url)
+        d.addCallback(lambda _: self.cache.get(url, size=size) or path)
+        return d
+
+    def download(self, url):
+        from twisted.web.http_headers import Headers
+        headers = Headers({'User-Agent': [self.AGENT]})
+        etag, lastModified = self.cache.validators(url)
+        if etag:
+            headers.addRawHeader('If-None-Match', toBytes(etag))
+        if lastModified:
+            headers.addRawHeader('If-Modified-Since', toBytes(lastModified))
+        d = self.agent.request('GET', url, headers)
+        d.addCallback(self.gotResponse, url, bool(etag or lastModified))
+        timeoutCall = reactor.callLater(ARTWORK_DOWNLOAD_TIMEOUT, d.cancel)
+
+        def cancelTimeout(result):
+            if timeoutCall.active():
+                timeoutCall.cancel()
+            return result
+        d.addBoth(cancelTimeout)
+        d.addErrback(self.downloadFailed, url)
+        return d
+
+    def gotResponse(self, response, url, revalidating):
+        from twisted.web import error
+        from twisted.web.client import readBody
+        if response.code == 304 and revalidating:
+            path = self.cache.revalidated(url)
+            if path is None:
+                raise error.Error('304', response.phrase)
+            return path
+        d = readBody(response)
+        d.addCallback(self.downloadSuccess, url, response)
+        return d
+
+    def downloadSuccess(self, body, url, response):
+        from twisted.web import error
+        if response.code != 200:
+            raise error.Error(str(response.code), response.phrase)
+        tmpPath = self.cache.tempPath(url)
+        try:
+            with open(tmpPath, 'wb') as f:
+                f.write(body)
+        except IOError:
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+            raise
+        etag = response.headers.getRawHeaders('etag', [None])[0]
+        lastModified = response.headers.getRawHeaders('last-modified', [None])[0]
+        path = self.cache.insert(url, tmpPath, etag, lastModified)
+        # callers which asked for a size wait for the variants in getVariant()
+        self.cache.createVariants(url).addErrback(self.variantsFailed, url)
+        return path
+
+    def variantsFailed(self, reason, url):
+        print '[ArtworkDownloader] cannot create variants of "%s": %s' % (url, reason.getErrorMessage())
+
+    def downloadFailed(self, reason, url):
+        path = self.cache.get(url)
+        if path:
+            print '[ArtworkDownloader] failed to refresh "%s", using cached file: %s' % (url, reason.getErrorMessage())
+            return path
+        return reason
+
+    def downloadDone(self, result, url):
+        for d in self.pending.pop(url):
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+
+PIXMAP_CACHE = PixmapCache()
+
+ARTWORK_CACHE = None
+ARTWORK_DOWNLOADER = None
+# returns the ArtworkCache arguments, set by setupArtworkCache()
+ARTWORK_CACHE_SETTINGS = None
+
+
+def setupArtworkCache(getSettings):
+    """Sets the function returning the ArtworkCache arguments as dict,
+    it's called when the cache is created on first use"""
+    global ARTWORK_CACHE, ARTWORK_DOWNLOADER, ARTWORK_CACHE_SETTINGS
+    ARTWORK_CACHE = None
+    ARTWORK_DOWNLOADER = None
+    ARTWORK_CACHE_SETTINGS = getSettings
+
+
+def getArtworkCache():
+    global ARTWORK_CACHE
+    if ARTWORK_CACHE is None:
+        settings = ARTWORK_CACHE_SETTINGS is not None and ARTWORK_CACHE_SETTINGS() or {}
+        ARTWORK_CACHE = ArtworkCache(**settings)
+    return ARTWORK_CACHE
+
+
+def getArtworkDownloader():
+    global ARTWORK_DOWNLOADER
+    if ARTWORK_DOWNLOADER is None:
+        ARTWORK_DOWNLOADER = ArtworkDownloader(getArtworkCache())
+    return ARTWORK_DOWNLOADER
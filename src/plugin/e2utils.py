@@ -1,7 +1,10 @@
 # -*- coding: UTF-8 -*-
-import base64
+import ctypes
+import ctypes.util
 import os
-from twisted.web.client import downloadPage
+import signal
+import time
+from collections import deque
 
 from Components.AVSwitch import AVSwitch
 from Components.ActionMap import HelpableActionMap
@@ -16,6 +19,8 @@ from Screens.Screen import Screen
 from skin import parseColor
 from enigma import iPlayableService, ePicLoad, ePixmap, eTimer, getDesktop
 
+from artwork import getArtworkDownloader, PIXMAP_CACHE
+
 
 def toString(text):
     if text is None:
@@ -75,15 +80,431 @@ def seekToPts(session, pts):
         return seek.seekTo(pts)
 
 
+def readProcessStat(pid):
+    """Returns the /proc/<pid>/stat fields from state (3) on, None if
+    the process is gone"""
+    try:
+        with open("/proc/%d/stat" % pid, "r") as f:
+            stat = f.read()
+    except IOError:
+        return None
+    # fields following the command name, which may contain spaces
+    return stat[stat.rindex(")") + 2:].split()
+
+
+def getProcessStartTime(pid):
+    """Returns the start time of process pid, which tells a pid
+    reused by a new process apart, None if it's gone"""
+    fields = readProcessStat(pid)
+    if fields is None:
+        return None
+    return int(fields[19])
+
+
+def findProcesses(name):
+    """Returns pids of the running processes with command name, oldest first"""
+    procs = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/comm" % entry, "r") as f:
+                if f.read().strip() != name:
+                    continue
+        except IOError:
+            # already exited
+            continue
+        fields = readProcessStat(int(entry))
+        if fields is None or fields[0] == "Z":
+            continue
+        procs.append((int(fields[19]), int(entry)))
+    return [pid for started, pid in sorted(procs)]
+
+
+PRIO_PROCESS = 0
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_IDLE = 3
+# machine prefix -> architecture family
+ARCH_FAMILIES = (
+    ("mips", "mips"),
+    ("aarch64", "arm"),
+    ("arm", "arm"),
+    ("sh", "sh"),
+    ("x86_64", "x86"),
+    ("i386", "x86"),
+    ("i486", "x86"),
+    ("i586", "x86"),
+    ("i686", "x86"),
+)
+# (family, pointer size of the userland) -> (ioprio_set, ioprio_get)
+# syscall numbers, no libc wrappers, the kernel may be 64 bit under a
+# 32 bit enigma2
+IOPRIO_SYSCALLS = {
+    ("mips", 4): (4314, 4315),
+    ("mips", 8): (5273, 5274),
+    ("arm", 4): (314, 315),
+    ("arm", 8): (30, 31),
+    ("sh", 4): (288, 289),
+    ("x86", 4): (289, 290),
+    ("x86", 8): (251, 252),
+}
+
+
+def getIoprioSyscalls():
+    """Returns (ioprio_set, ioprio_get) syscall numbers of this userland,
+    None if they aren't known"""
+    machine = os.uname()[4]
+    for prefix, family in ARCH_FAMILIES:
+        if machine.startswith(prefix):
+            return IOPRIO_SYSCALLS.get((family, ctypes.sizeof(ctypes.c_void_p)))
+    return None
+
+
+class ProcessThrottle(object):
+    """
+    Lowers the CPU and IO priority of all threads of processes or
+    stops them, restore() undoes it
+    """
+
+    def __init__(self):
+        self.libc = None
+        self.ioprioSyscalls = None
+        # pid -> (start time, {tid: (nice, io priority) before nice()})
+        self.niced = {}
+        # pid -> start time
+        self.frozen = {}
+
+    def loadLibc(self):
+        if self.libc is None:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            self.ioprioSyscalls = getIoprioSyscalls()
+            if self.ioprioSyscalls is None:
+                print '[ProcessThrottle] unknown architecture %s, not changing io priorities' % os.uname()[4]
+        return self.libc
+
+    def listThreads(self, pid):
+        try:
+            return [int(tid) for tid in os.listdir("/proc/%d/task" % pid)]
+        except OSError:
+            return []
+
+    def nice(self, pids, nice=19):
+        libc = self.loadLibc()
+        for pid in pids:
+            started = getProcessStartTime(pid)
+            if started is None:
+                continue
+            saved = self.niced.get(pid)
+            if saved is None or saved[0] != started:
+                saved = self.niced[pid] = (started, {})
+            threads = saved[1]
+            for tid in self.listThreads(pid):
+                if tid in threads:
+                    continue
+                ctypes.set_errno(0)
+                oldNice = libc.getpriority(PRIO_PROCESS, tid)
+                if oldNice == -1 and ctypes.get_errno():
+                    continue
+                oldIoprio = -1
+                if self.ioprioSyscalls is not None:
+                    oldIoprio = libc.syscall(self.ioprioSyscalls[1], IOPRIO_WHO_PROCESS, tid)
+                    libc.syscall(self.ioprioSyscalls[0], IOPRIO_WHO_PROCESS, tid, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT)
+                libc.setpriority(PRIO_PROCESS, tid, nice)
+                threads[tid] = (oldNice, oldIoprio)
+        print '[ProcessThrottle] lowered priority of %d threads' % sum(len(threads) for started, threads in self.niced.values())
+
+    def freeze(self, pids):
+        for pid in pids:
+            started = getProcessStartTime(pid)
+            if started is None:
+                continue
+            try:
+                os.kill(pid, signal.SIGSTOP)
+            except OSError as e:
+                print '[ProcessThrottle] cannot stop %d: %s' % (pid, str(e))
+            else:
+                self.frozen[pid] = started
+
+    def restore(self):
+        # a pid or tid may have been reused by now, only processes which
+        # are still the throttled ones and their current threads are touched
+        resumed = restored = 0
+        for pid, started in self.frozen.items():
+            if getProcessStartTime(pid) != started:
+                continue
+            try:
+                os.kill(pid, signal.SIGCONT)
+            except OSError:
+                continue
+            resumed += 1
+        for pid, (started, threads) in self.niced.items():
+            if getProcessStartTime(pid) != started:
+                continue
+            # threads started meanwhile inherited the lowered priority,
+            # they get the one the main thread had
+            default = threads.get(pid)
+            for tid in self.listThreads(pid):
+                old = threads.get(tid, default)
+                if old is None:
+                    continue
+                oldNice, oldIoprio = old
+                self.libc.setpriority(PRIO_PROCESS, tid, oldNice)
+                if oldIoprio >= 0:
+                    self.libc.syscall(self.ioprioSyscalls[0], IOPRIO_WHO_PROCESS, tid, oldIoprio)
+                restored += 1
+        if self.frozen or self.niced:
+            print '[ProcessThrottle] restored %d processes, %d threads' % (resumed, restored)
+        self.frozen = {}
+        self.niced = {}
+
+
+class PendingSeek(object):
+    """
+    Waits until the current service reports a play position, which
+    is when it can be seeked, and calls callback(True) then
+
+    The position is checked on the service events passed on to
+    serviceEvent() and in between with a growing backoff. When there's
+    still no position after timeout ms callback(False) is called, with
+    timeout 0 it waits until stop() is called.
+    """
+    RETRY_DELAYS = (50, 100, 200, 400, 800)
+    TIMEOUT = 10000
+
+    def __init__(self, session, callback, timeout=TIMEOUT):
+        self.session = session
+        self.callback = callback
+        self.timeout = timeout
+        self.active = False
+        self.started = 0
+        self.retries = 0
+        self.timer = eTimer()
+        self.timer.callback.append(self.check)
+
+    def start(self):
+        self.active = True
+        self.started = time.time()
+        self.retries = 0
+        self.check()
+
+    def stop(self):
+        self.active = False
+        self.timer.stop()
+
+    def serviceEvent(self):
+        if self.active:
+            self.check()
+
+    def check(self):
+        self.timer.stop()
+        if not self.active:
+            return
+        if getPlayPositionPts(self.session) is not None:
+            self.active = False
+            self.callback(True)
+            return
+        elapsed = (time.time() - self.started) * 1000
+        if self.timeout and elapsed >= self.timeout:
+            print '[PendingSeek] no play position after %d ms, not seeking' % elapsed
+            self.active = False
+            self.callback(False)
+            return
+        delay = self.RETRY_DELAYS[min(self.retries, len(self.RETRY_DELAYS) - 1)]
+        self.retries += 1
+        self.timer.start(delay, True)
+
+
+class DirectoryIndex(object):
+    """
+    File names of media directories, a directory is listed again when
+    its mtime changes, so a lookup costs one stat of the directory
+    instead of one stat per probed file
+    """
+    MAX_ENTRIES = 64
+
+    def __init__(self):
+        self.directories = {}
+
+    def listdir(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            return frozenset()
+        record = self.directories.get(directory)
+        if record is None or record[0] != mtime:
+            try:
+                names = frozenset(os.listdir(directory))
+            except OSError:
+                names = frozenset()
+            if len(self.directories) >= self.MAX_ENTRIES:
+                self.directories.clear()
+            record = self.directories[directory] = (mtime, names)
+        return record[1]
+
+    def exists(self, path):
+        directory, name = os.path.split(path)
+        return bool(name) and name in self.listdir(directory)
+
+    def findSidecar(self, path, extensions):
+        # first existing path + extension
+        directory, name = os.path.split(path)
+        names = self.listdir(directory)
+        for extension in extensions:
+            if name + extension in names:
+                return path + extension
+        return None
+
+
+DIRECTORY_INDEX = DirectoryIndex()
+
+
+class SpzTxt(object):
+    """
+    Parsed .spztxt sidecar file, the '->' entries (title, plot, ...)
+    and the 'key: value' fields
+    """
+    def __init__(self, entries, fields):
+        self.entries = entries
+        self.fields = fields
+        self.title = entries and entries[0] or None
+        self.plot = len(entries) > 1 and entries[1] or u''
+        genre = fields.get(u'Género')
+        self.genre = genre and genre.split(u' | ') or []
+
+
+def parseSpzTxt(path):
+    entries = []
+    fields = {}
+    with open(path, "r") as f:
+        for line in f:
+            line = line.rstrip('\r\n').decode('utf-8', 'replace')
+            idx = line.find(u'->')
+            if idx != -1:
+                entries.append(line[idx + 3:])
+            elif u':' in line:
+                key, value = line.split(u':', 1)
+                fields.setdefault(key, value.strip())
+    return SpzTxt(entries, fields)
+
+
+class SpzTxtCache(object):
+    """
+    Parsed .spztxt files, a file is parsed again when its mtime changes
+    """
+    MAX_ENTRIES = 64
+
+    def __init__(self):
+        self.records = {}
+
+    def get(self, path):
+        if not DIRECTORY_INDEX.exists(path):
+            return None
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        record = self.records.get(path)
+        if record is None or record[0] != mtime:
+            try:
+                spzTxt = parseSpzTxt(path)
+            except IOError as e:
+                print '[SpzTxtCache] failed to parse "%s": %s' % (path, str(e))
+                return None
+            if len(self.records) >= self.MAX_ENTRIES:
+                self.records.clear()
+            record = self.records[path] = (mtime, spzTxt)
+        return record[1]
+
+
+SPZTXT_CACHE = SpzTxtCache()
+
+
+class AVStateManager(object):
+    """
+    Last known state of the /proc/stb audio and video settings
+
+    Each setting is read once and then tracked, apply() writes only the
+    settings which differ from it. invalidate() forgets the state when
+    something else may have changed the settings.
+    """
+    # in the order they are written
+    FIELDS = ("aspect", "policy", "policy2", "ac3", "dts", "aac", "aacplus")
+    PATHS = {
+        "aspect": "/proc/stb/video/aspect",
+        "policy": "/proc/stb/video/policy",
+        "policy2": "/proc/stb/video/policy2",
+        "ac3": "/proc/stb/audio/ac3",
+        "dts": "/proc/stb/audio/dts",
+        "aac": "/proc/stb/audio/aac",
+        "aacplus": "/proc/stb/audio/aacplus",
+    }
+
+    def __init__(self):
+        # field -> value, None if the box doesn't support it
+        self.state = {}
+
+    def read(self, field):
+        if field not in self.state:
+            try:
+                with open(self.PATHS[field], "r") as f:
+                    self.state[field] = f.read().strip()
+            except IOError:
+                self.state[field] = None
+        return self.state[field]
+
+    def snapshot(self, fields=FIELDS):
+        """Returns {field: value} of the supported fields"""
+        snapshot = {}
+        for field in fields:
+            value = self.read(field)
+            if value is not None:
+                snapshot[field] = value
+        return snapshot
+
+    def apply(self, state):
+        """Writes the fields of state {field: value} which differ from
+        the known state, None values are skipped, returns the written fields"""
+        written = []
+        for field in self.FIELDS:
+            value = state.get(field)
+            if value is None or self.read(field) in (None, value):
+                continue
+            try:
+                with open(self.PATHS[field], "w") as f:
+                    f.write(value)
+            except IOError as e:
+                print '[AVStateManager] cannot set %s to "%s": %s' % (field, value, str(e))
+                del self.state[field]
+                continue
+            self.state[field] = value
+            written.append(field)
+        if written:
+            print '[AVStateManager] set %s' % ", ".join("%s=%s" % (field, state[field]) for field in written)
+        return written
+
+    def invalidate(self, fields=None):
+        """Forgets the known state of fields, of all fields by default"""
+        if fields is None:
+            self.state.clear()
+            return
+        for field in fields:
+            self.state.pop(field, None)
+
+
+AV_STATE = AVStateManager()
+
+
 class WebPixmap(GUIComponent):
     GUI_WIDGET = ePixmap
 
-    def __init__(self, default=None, cachedir='/tmp/', caching=True):
+    def __init__(self, default=None, downloader=None, caching=True):
         GUIComponent.__init__(self)
         self.caching = caching
-        self.cachedir = cachedir
+        self.downloader = downloader
         self.default = default
         self.currentUrl = None
+        self.picloadPara = None
         self.picload = ePicLoad()
         self.picload.PictureData.get().append(self.setPixmapCB)
 
@@ -101,10 +522,9 @@ class WebPixmap(GUIComponent):
         return res
 
     def onShow(self):
-        sc = getAspect()
-        resize = False
-        background = "#00000000"
-        self.picload.setPara((self.instance.size().width(), self.instance.size().height(), sc[0], sc[1], False, resize, background))
+        # decoded pixmaps are cached per source and decode parameters
+        self.picloadPara = getPicloadPara(self.instance.size().width(), self.instance.size().height())
+        self.picload.setPara(self.picloadPara + (False, False, "#00000000"))
         if self.currentUrl is None:
             self.load(self.default)
 
@@ -112,8 +532,13 @@ class WebPixmap(GUIComponent):
         self.__currentUrl = filePath
         self.picload.startDecode(filePath)
 
-    def loadFromUrl(self, url, destPath):
-        def loadSuccess(callback=None):
+    def getSize(self):
+        if self.picloadPara is None:
+            return None
+        return self.picloadPara[:2]
+
+    def loadFromUrl(self, url, downloader):
+        def loadSuccess(destPath):
             self.__currentUrl = destPath
             self.picload.startDecode(destPath)
 
@@ -122,8 +547,8 @@ class WebPixmap(GUIComponent):
             if self.instance:
                 self.load(self.default)
 
-        agent = "Mozilla/5.0 (Windows; U; Windows NT 5.1; de; rv:1.9.0.2) Gecko/2008091620 Firefox/3.0.2"
-        d = downloadPage(url, destPath, agent=agent)
+        # the variant scaled to the widget size if there's one
+        d = downloader.fetch(url, self.getSize())
         d.addCallback(loadSuccess)
         d.addErrback(loadFailed)
 
@@ -134,17 +559,24 @@ class WebPixmap(GUIComponent):
         if url == self.currentUrl:
             print '[WebPixmap] load - already loaded'
             return
+        if not url:
+            return
+        if self.picloadPara is not None and self.instance:
+            ptr = PIXMAP_CACHE.get((url,) + self.picloadPara)
+            if ptr is not None:
+                self.currentUrl = url
+                self.instance.setPixmap(ptr.__deref__())
+                return
+        self.__currentSource = url
         if os.path.isfile(url):
             self.loadFromFile(url)
         elif url.startswith("http"):
-            tmpPath = os.path.join(self.cachedir, base64.encodestring(url))
-            if self.caching:
-                if os.path.isfile(tmpPath):
-                    self.loadFromFile(tmpPath)
-                else:
-                    self.loadFromUrl(url, tmpPath)
+            downloader = self.downloader or getArtworkDownloader()
+            cachedPath = self.caching and downloader.cache.get(url, fresh=True, size=self.getSize())
+            if cachedPath:
+                self.loadFromFile(cachedPath)
             else:
-                self.loadFromUrl(url, tmpPath)
+                self.loadFromUrl(url, downloader)
         else:
             print '[WebPixmap] load - file not found or unsupported url: "%s"' % (str(url))
 
@@ -153,9 +585,92 @@ class WebPixmap(GUIComponent):
         if ptr and self.instance:
             self.currentUrl = self.__currentUrl
             del self.__currentUrl
+            if self.picloadPara is not None:
+                PIXMAP_CACHE.put((self.__currentSource,) + self.picloadPara, ptr)
             self.instance.setPixmap(ptr.__deref__())
 
 
+def getPicloadPara(width, height):
+    sc = getAspect()
+    return (width, height, sc[0], sc[1])
+
+
+class ArtworkPrefetcher(object):
+    """
+    Downloads artwork and decodes it into PIXMAP_CACHE for the given
+    widget size, so a WebPixmap shown later finds it already decoded
+    """
+
+    def __init__(self):
+        self.picload = ePicLoad()
+        self.picload.PictureData.get().append(self.decodeFinished)
+        # (pixmap cache key, path) waiting for the decoder
+        self.decodes = deque()
+        self.decoding = None
+
+    def prefetch(self, url, size, decode=True):
+        url = toString(url)
+        if not url:
+            return
+        key = (url,) + getPicloadPara(*size)
+        if PIXMAP_CACHE.get(key) is not None:
+            return
+        if os.path.isfile(url):
+            if decode:
+                self.decode(key, url)
+        elif url.startswith("http"):
+            downloader = getArtworkDownloader()
+            cachedPath = downloader.cache.get(url, fresh=True, size=size)
+            if cachedPath:
+                if decode:
+                    self.decode(key, cachedPath)
+            else:
+                if decode:
+                    d = downloader.fetch(url, size)
+                    d.addCallback(lambda path: self.decode(key, path))
+                else:
+                    d = downloader.fetch(url)
+                d.addErrback(self.fetchFailed, url)
+
+    def fetchFailed(self, failure, url):
+        print '[ArtworkPrefetcher] cannot fetch "%s": %s' % (url, failure.getErrorMessage())
+
+    def decode(self, key, path):
+        self.decodes.append((key, path))
+        if self.decoding is None:
+            self.decodeNext()
+
+    def decodeNext(self):
+        while self.decodes:
+            self.decoding = self.decodes.popleft()
+            key, path = self.decoding
+            if PIXMAP_CACHE.get(key) is not None:
+                continue
+            self.picload.setPara(key[1:] + (False, False, "#00000000"))
+            if self.picload.startDecode(path) == 0:
+                return
+            print '[ArtworkPrefetcher] cannot decode "%s"' % path
+        self.decoding = None
+
+    def decodeFinished(self, picInfo=None):
+        ptr = self.picload.getData()
+        if ptr and self.decoding is not None:
+            PIXMAP_CACHE.put(self.decoding[0], ptr)
+        self.decodeNext()
+
+
+ARTWORK_PREFETCHER = None
+
+
+def prefetchArtwork(url, size, decode=True):
+    """Starts fetching and decoding url for a size (width, height) widget,
+    with decode=False only fetching it into the artwork cache"""
+    global ARTWORK_PREFETCHER
+    if ARTWORK_PREFETCHER is None:
+        ARTWORK_PREFETCHER = ArtworkPrefetcher()
+    ARTWORK_PREFETCHER.prefetch(url, size, decode)
+
+
 class BufferIndicatorDetailed(Screen):
     def __init__(self, session, updateIntervalInMs=500):
         desktopWidth = getDesktop(0).size().width()
@@ -235,6 +750,8 @@ class InfoBarAspectChange(object):
         '4_3_bestfit': {'aspect': '4:3', 'policy': 'bestfit', 'policy2': 'policy', 'title': _("Just scale")}
     }
 
+    ASPECT_FIELDS = ("aspect", "policy", "policy2")
+
     V_MODES = ['16_9_letterbox', '16_9_panscan', '16_9_nonlinear', '16_9_bestfit',
         '16_9_4_3_pillarbox', '16_9_4_3_panscan', '16_9_4_3_nonlinear', '16_9_4_3_bestfit',
         '4_3_letterbox', '4_3_panscan', '4_3_bestfit'
@@ -243,18 +760,9 @@ class InfoBarAspectChange(object):
     def __init__(self):
         self.postAspectChange = []
         self.aspectChanged = False
-        try:
-            self.defaultAspect = open("/proc/stb/video/aspect", "r").read().strip()
-        except IOError:
-            self.defaultAspect = None
-        try:
-            self.defaultPolicy = open("/proc/stb/video/policy", "r").read().strip()
-        except IOError:
-            self.defaultPolicy = None
-        try:
-            self.defaultPolicy2 = open("/proc/stb/video/policy2", "r").read().strip()
-        except IOError:
-            self.defaultPolicy2 = None
+        # the user may have changed them in enigma2 since they were read
+        AV_STATE.invalidate(self.ASPECT_FIELDS)
+        self.defaultAspectState = AV_STATE.snapshot(self.ASPECT_FIELDS)
         self.currentAVMode = self.V_MODES[0]
 
         self["aspectChangeActions"] = HelpableActionMap(self, "InfoBarAspectChangeActions",
@@ -272,21 +780,7 @@ class InfoBarAspectChange(object):
 
     def setAspect(self, aspect, policy, policy2):
         print 'aspect: %s policy: %s policy2: %s' % (str(aspect), str(policy), str(policy2))
-        if aspect:
-            try:
-                open("/proc/stb/video/aspect", "w").write(aspect)
-            except IOError as e:
-                print e
-        if policy:
-            try:
-                open("/proc/stb/video/policy", "w").write(policy)
-            except IOError as e:
-                print e
-        if policy2:
-            try:
-                open("/proc/stb/video/policy2", "w").write(policy2)
-            except IOError as e:
-                print e
+        AV_STATE.apply({"aspect": aspect, "policy": policy, "policy2": policy2})
         for f in self.postAspectChange:
             f()
 
@@ -306,7 +800,8 @@ class InfoBarAspectChange(object):
 
     def __onClose(self):
         if self.aspectChanged:
-            self.setAspect(self.defaultAspect, self.defaultPolicy, self.defaultPolicy2)
+            state = self.defaultAspectState
+            self.setAspect(state.get("aspect"), state.get("policy"), state.get("policy2"))
 
 
 class MyAudioSelection(AudioSelection):
@@ -356,9 +851,12 @@ class InfoBarSubservicesSupport(object):
     def __init__(self):
         self["InfoBarSubservicesActions"] = HelpableActionMap(self,
                 "ColorActions", {"green": (self.showSubservices, _("Show subservices"))}, -2)
-        self.__timer = eTimer()
-        self.__timer.callback.append(self.__seekToCurrentPosition)
-        self.onClose.append(self.__timer.stop)
+        self.__subserviceSeek = PendingSeek(self.session, self.__seekToCurrentPosition)
+        self.__subserviceEventTracker = ServiceEventTracker(screen=self, eventmap={
+                iPlayableService.evStart: self.__subserviceSeek.serviceEvent,
+                iPlayableService.evSeekableStatusChanged: self.__subserviceSeek.serviceEvent,
+            })
+        self.onClose.append(self.__subserviceSeek.stop)
 
     def showSubservices(self):
         service = self.session.nav.getCurrentService()
@@ -380,17 +878,15 @@ class InfoBarSubservicesSupport(object):
 
     def subserviceSelected(self, service_ref):
         if service_ref:
-            self.__timer.stop()
+            self.__subserviceSeek.stop()
             self.__playpos = getPlayPositionPts(self.session) or 0
             duration = getDurationPts(self.session) or 0
+            self.session.nav.playService(service_ref[1])
             if (self.__playpos > 0 and duration > 0
                     and self.__playpos < duration):
-                self.__timer.start(500, True)
-            self.session.nav.playService(service_ref[1])
+                self.__subserviceSeek.start()
 
-    def __seekToCurrentPosition(self):
-        if getPlayPositionPts(self.session) is None:
-            self.__timer.start(500, True)
-        else:
+    def __seekToCurrentPosition(self, seekable):
+        if seekable:
             seekToPts(self.session, self.__playpos)
-            del self.__playpos
+        del self.__playpos
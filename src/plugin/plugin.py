@@ -1,8 +1,15 @@
 # -*- encoding: utf-8 -*-
-from Queue import Queue
+from Queue import Queue, Empty
+from collections import namedtuple
+import hashlib
 import json
+import logging
 import os
+import signal
 import threading
+import time
+
+IMPORT_STARTED = time.time()
 
 from Components.ActionMap import ActionMap
 from Components.Label import Label
@@ -17,23 +24,26 @@ from Screens.InfoBarGenerics import InfoBarNotifications, InfoBarSeek, \
     InfoBarAudioSelection, InfoBarShowHide, InfoBarSubtitleSupport
 from Screens.MessageBox import MessageBox
 from Screens.Screen import Screen
-from Tools.Directories import fileExists
 from Tools import Notifications
 
-from Components.config import config
+from Components.config import config, ConfigSubsection, ConfigText, \
+    ConfigInteger, ConfigYesNo, ConfigSelection
 try:
     from Components.AVSwitch import iAVSwitch
 except:
     from Plugins.SystemPlugins.Videomode.VideoHardware import video_hw as iAVSwitch
 
+from artwork import setupArtworkCache
 from e2utils import InfoBarAspectChange, WebPixmap, MyAudioSelection, \
     StatusScreen, getPlayPositionInSeconds, getDurationInSeconds, \
-    InfoBarSubservicesSupport
+    InfoBarSubservicesSupport, DIRECTORY_INDEX, SPZTXT_CACHE, toString, \
+    prefetchArtwork, findProcesses, ProcessThrottle, PendingSeek, AV_STATE
 from enigma import eServiceReference, eTimer, ePythonMessagePump, \
     iPlayableService, fbClass, eRCInput, getDesktop, eDVBVolumecontrol
 from Components.SystemInfo import SystemInfo
-from server import KodiExtRequestHandler, UDSServer
+from server import KodiExtRequestHandler, UDSServer, PendingRequest
 from Tools.BoundFunction import boundFunction
+from Tools.Directories import fileExists
 from boxbranding import getMachineBrand
 try:
     from Plugins.Extensions.SubsSupport import SubsSupport, SubsSupportStatus
@@ -51,14 +61,76 @@ OP_CODE_PLAY,
 OP_CODE_PLAY_STATUS,
 OP_CODE_PLAY_STOP,
 OP_CODE_SWITCH_TO_ENIGMA2,
-OP_CODE_SWITCH_TO_KODI) = range(6)
-
-KODIRUN_SCRIPT = "unset PYTHONPATH;kodi;kodiext -T"
+OP_CODE_SWITCH_TO_KODI,
+OP_CODE_PLAY_STATUS_SUBSCRIBE,
+OP_CODE_STATS,
+OP_CODE_PREFETCH) = range(9)
+
+OP_CODE_NAMES = {
+    OP_CODE_EXIT: "OP_CODE_EXIT",
+    OP_CODE_PLAY: "OP_CODE_PLAY",
+    OP_CODE_PLAY_STATUS: "OP_CODE_PLAY_STATUS",
+    OP_CODE_PLAY_STOP: "OP_CODE_PLAY_STOP",
+    OP_CODE_SWITCH_TO_ENIGMA2: "OP_CODE_SWITCH_TO_ENIGMA2",
+    OP_CODE_SWITCH_TO_KODI: "OP_CODE_SWITCH_TO_KODI",
+    OP_CODE_PLAY_STATUS_SUBSCRIBE: "OP_CODE_PLAY_STATUS_SUBSCRIBE",
+    OP_CODE_STATS: "OP_CODE_STATS",
+    OP_CODE_PREFETCH: "OP_CODE_PREFETCH",
+}
+
+# exits with the status of kodi, not of kodiext
+KODIRUN_SCRIPT = "unset PYTHONPATH;kodi;status=$?;kodiext -T;exit $status"
 KODIRESUME_SCRIPT = "kodiext -P %s -K"
+# hides Kodi without switching to enigma2, which is shown already
+KODIHIDE_SCRIPT = "config -pid %d -visible off"
+# kodi exit codes of quit, power down, restart and reboot from its menu,
+# anything else is a crash
+KODI_EXIT_CODES = (0, 64, 65, 66)
 KODIEXT_SOCKET = "/tmp/kodiext.socket"
 KODIEXTIN = "/tmp/kodiextin.json"
+# best Kodi video mode per video port, box brand and connected display
+VIDEO_MODES_CACHE = "/etc/enigma2/kodi_videomodes.json"
+VIDEO_MODES_CACHE_MAX_ENTRIES = 8
+
+# seconds to wait for the main loop to handle a request
+REQUEST_TIMEOUT = 5
+REQUEST_TIMEOUTS = {
+    OP_CODE_PLAY: 15,
+}
+
+# ms between play status snapshot updates while playing
+PLAY_STATUS_INTERVAL = 500
+
+# ms to wait for a client switching to enigma2 to close its connection
+STOP_LAUNCHER_TIMEOUT = 2000
+
+# standby Kodi timing, ms
+STANDBY_BOOT_DELAY = 60000
+STANDBY_RESTART_DELAY = 10000
+# short, so a new Kodi is hidden before it has set up its window
+STANDBY_POLL_INTERVAL = 50
+STANDBY_START_TIMEOUT = 30000
+STANDBY_HIDE_AGAIN_DELAY = 5000
+# a standby Kodi exiting sooner than this (seconds) isn't restarted
+STANDBY_MIN_UPTIME = 60
+
+config.plugins.kodi = ConfigSubsection()
+config.plugins.kodi.artworkCacheDir = ConfigText(default="/tmp/kodi_artwork/", fixed_size=False)
+config.plugins.kodi.artworkCacheSize = ConfigInteger(default=20, limits=(1, 1024))
+# play videos from Kodi in the Kodi video mode, saves two HDMI resyncs per video
+config.plugins.kodi.keepKodiMode = ConfigYesNo(default=False)
+# keep Kodi started and hidden in the background, so the plugin resumes it
+config.plugins.kodi.standby = ConfigYesNo(default=False)
+# seconds to wait for a stream to become seekable to resume it, 0 = no limit
+config.plugins.kodi.resumeTimeout = ConfigInteger(default=60, limits=(0, 3600))
+# what to do with Kodi while the enigma2 player plays a video from Kodi
+config.plugins.kodi.throttle = ConfigSelection(default="none", choices=[
+    ("none", _("nothing")),
+    ("nice", _("lower priority")),
+    ("freeze", _("freeze"))])
 
 KODI_LAUNCHER = None
+KODI_STANDBY = None
 
 SESSION = None
 SERVER = None
@@ -68,86 +140,129 @@ _g_dw, _g_dh = 1280, 720
 
 
 class SetAudio:
+    # audio settings used while Kodi is running
+    KODI_STATE = {
+        "ac3": "downmix",
+        "dts": "downmix",
+        "aac": "passthrough",
+        "aacplus": "passthrough"}
+
     def __init__(self):
         self.VolPrev = 0
         self.VolPlayer = 0
         self.volctrl = eDVBVolumecontrol.getInstance()
-        self.ac3 = "downmix"
-        self.dts = "downmix"
-        self.aac = "passthrough"
-        self.aacplus = "passthrough"
+        self.fields = []
+        for field, capability in (("ac3", "CanDownmixAC3"), ("dts", "CanDownmixDTS"),
+                ("aac", "CanDownmixAAC"), ("aacplus", "CanDownmixAACPlus")):
+            if SystemInfo[capability]:
+                self.fields.append(field)
+        # enigma2 audio settings saved by ReadData()
+        self.e2State = {}
 
     def switch(self, Tokodi=False, Player=False):
         if Tokodi:
             if Player:
                 self.VolPlayer = self.volctrl.getVolume()
             vol = 100
-            ac3 = "downmix"
-            dts = "downmix"
-            aac = "passthrough"
-            aacplus = "passthrough"
+            state = self.KODI_STATE
+            # the audio selection of the player or anything else may have
+            # written them while enigma2 was in charge
+            AV_STATE.invalidate(self.fields)
         else:
             if Player:
                 vol = self.VolPlayer
             else:
                 vol = self.VolPrev
-            ac3 = self.ac3
-            dts = self.dts
-            aac = self.aac
-            aacplus = self.aacplus
-
-        self.volctrl.setVolume(vol, vol)
-
-        if SystemInfo["CanDownmixAC3"]:
-            try:
-                open("/proc/stb/audio/ac3", "w").write(ac3)
-            except:
-                pass
+            state = self.e2State
 
-        if SystemInfo["CanDownmixDTS"]:
-            try:
-                open("/proc/stb/audio/dts", "w").write(dts)
-            except:
-                pass
-
-        if SystemInfo["CanDownmixAAC"]:
-            try:
-                open("/proc/stb/audio/aac", "w").write(aac)
-            except:
-                pass
-
-        if SystemInfo["CanDownmixAACPlus"]:
-            try:
-                open("/proc/stb/audio/aacplus", "w").write(aacplus)
-            except:
-                pass
+        if self.volctrl.getVolume() != vol:
+            self.volctrl.setVolume(vol, vol)
+        # the whole transition in one batch, unchanged settings are skipped
+        AV_STATE.apply(dict((field, state.get(field)) for field in self.fields))
 
     def ReadData(self):
         self.VolPrev = self.volctrl.getVolume()
         self.VolPlayer = self.VolPrev
-        if SystemInfo["CanDownmixAC3"]:
-            try:
-                self.ac3 = open("/proc/stb/audio/ac3", "r").read()
-            except:
-                pass
-
-        if SystemInfo["CanDownmixDTS"]:
-            try:
-                self.dts = open("/proc/stb/audio/dts", "r").read()
-            except:
-                pass
+        # enigma2 settings may have been changed since the last run
+        AV_STATE.invalidate()
+        self.e2State = AV_STATE.snapshot(self.fields)
 
-        if SystemInfo["CanDownmixAAC"]:
-            try:
-                self.aac = open("/proc/stb/audio/aac", "r").read()
-            except:
-                pass
 
-        if SystemInfo["CanDownmixAACPlus"]:
-            try:
-                self.aacplus = open("/proc/stb/audio/aacplus", "r").read()
-            except:
-                pass
+def readVideoMode():
+    try:
+        with open("/proc/stb/video/videomode", "r") as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+
+def getVideoModeName(res, rate):
+    """Returns the /proc/stb/video/videomode name of res at rate,
+    None for multi/auto rates where the actual mode is up to the driver"""
+    # enigma2's own table knows names like "pal" or "1080i" for 60Hz
+    modes = getattr(iAVSwitch, "rates", {}).get(res, {}).get(rate)
+    if modes is not None:
+        if len(modes) != 1:
+            return None
+        return modes.values()[0]
+    if not rate.endswith("Hz"):
+        return None
+    rate = rate[:-2]
+    if rate == "60":
+        return res
+    return res + rate
+
+
+def getDisplayId():
+    # sha1 of the EDID of the connected display, None if unknown
+    try:
+        with open("/proc/stb/hdmi/raw_edid", "rb") as f:
+            edid = f.read()
+    except IOError:
+        return None
+    if not edid.strip("\0"):
+        return None
+    return hashlib.sha1(edid).hexdigest()
+
+
+class VideoModeCache(object):
+    """
+    Persistent cache of the video mode probe results
+    """
+    VERSION = 1
+
+    def __init__(self, path=VIDEO_MODES_CACHE, maxEntries=VIDEO_MODES_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.maxEntries = maxEntries
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                cache = json.load(f)
+            if cache.get("version") != self.VERSION:
+                raise ValueError("unsupported version")
+            return cache["entries"]
+        except Exception:
+            return {}
+
+    def get(self, key):
+        entry = self.load().get(key)
+        if entry is None:
+            return None
+        return str(entry["res"]), str(entry["rate"])
+
+    def put(self, key, res, rate):
+        entries = self.load()
+        entries[key] = {"res": res, "rate": rate, "probed": time.time()}
+        # forget the displays probed the longest time ago
+        while len(entries) > self.maxEntries:
+            del entries[min(entries, key=lambda k: entries[k]["probed"])]
+        try:
+            with open(self.path + ".part", "w") as f:
+                json.dump({"version": self.VERSION, "entries": entries}, f)
+            os.rename(self.path + ".part", self.path)
+        except (IOError, OSError) as e:
+            print "[SetResolution] cannot save video modes: %s" % str(e)
 
 
 class SetResolution:
@@ -157,37 +272,86 @@ class SetResolution:
         self.kodirate = "50Hz"
         self.port = config.av.videoport.value
         self.rate = None
-        if getMachineBrand() in ('Vu+', 'Formuler'):
-            resolutions = ("720i", "720p")
-        else:
-            resolutions = ("720i", "720p", "1080i", "1080p")
-            rates = ("60Hz", "50Hz")
-            for res in resolutions:
-                for rate in rates:
-                    try:
-                        if iAVSwitch.isModeAvailable(self.port, res, rate):
-                            self.kodires = res
-                            self.kodirate = rate
-                    except:
-                        pass
+        # (port, resolution, rate) last set
+        self.currentMode = None
+        if getMachineBrand() not in ('Vu+', 'Formuler'):
+            self.probeModes()
+
+    def probeModes(self):
+        # the best mode depends only on the port, box and display, so
+        # it's probed again only when one of them changes
+        displayId = getDisplayId()
+        key = None
+        if displayId is not None:
+            key = "%s:%s:%s" % (self.port, getMachineBrand(), displayId)
+            cached = VideoModeCache().get(key)
+            if cached is not None:
+                self.kodires, self.kodirate = cached
+                return
+        resolutions = ("720i", "720p", "1080i", "1080p")
+        rates = ("60Hz", "50Hz")
+        probed = False
+        for res in resolutions:
+            for rate in rates:
+                try:
+                    if iAVSwitch.isModeAvailable(self.port, res, rate):
+                        self.kodires = res
+                        self.kodirate = rate
+                        probed = True
+                except:
+                    pass
+        # the defaults aren't pinned for the display if probing failed
+        if key is not None and probed:
+            VideoModeCache().put(key, self.kodires, self.kodirate)
 
     def switch(self, Tokodi=False, Player=False):
         if Tokodi:
             if self.kodires and self.kodirate and self.port:
-                iAVSwitch.setMode(self.port, self.kodires, self.kodirate)
-                open("/proc/stb/video/videomode", "w").write(self.kodires + self.kodirate.replace("Hz", ""))
+                self.setMode(self.port, self.kodires, self.kodirate)
         else:
             if self.E2res and self.rate and self.port:
-	    	iAVSwitch.setMode(self.port, self.E2res, self.rate)
+	    	self.setMode(self.port, self.E2res, self.rate)
+
+    def setMode(self, port, res, rate):
+        # every real mode change costs the TV a HDMI resync
+        mode = (port, res, rate)
+        modeStr = getVideoModeName(res, rate)
+        videoMode = readVideoMode()
+        if mode == self.currentMode and (modeStr is None or videoMode in (None, modeStr)):
+            print "[SetResolution] %s %s already set" % (res, rate)
+            return
+        print "[SetResolution] switching to %s %s" % (res, rate)
+        iAVSwitch.setMode(port, res, rate)
+        self.currentMode = mode
+        # only if setMode() didn't set it already
+        if modeStr is not None and readVideoMode() not in (None, modeStr):
+            open("/proc/stb/video/videomode", "w").write(modeStr)
 
     def ReadData(self):
         self.E2res = config.av.videomode[self.port].value
 	self.rate = config.av.videorate[self.E2res].value
+	# enigma2 is in its configured mode now
+	self.currentMode = (self.port, self.E2res, self.rate)
 	self.switch(True)
 
 
-setaudio = SetAudio()
-setresolution = SetResolution()
+# created on first use, not at plugin import
+SET_AUDIO = None
+SET_RESOLUTION = None
+
+
+def getSetAudio():
+    global SET_AUDIO
+    if SET_AUDIO is None:
+        SET_AUDIO = SetAudio()
+    return SET_AUDIO
+
+
+def getSetResolution():
+    global SET_RESOLUTION
+    if SET_RESOLUTION is None:
+        SET_RESOLUTION = SetResolution()
+    return SET_RESOLUTION
 
 
 def SaveDesktopInfo():
@@ -198,20 +362,22 @@ def SaveDesktopInfo():
     except:
         _g_dw, _g_dh = 1280, 720
     print "[XBMC] Desktop size [%dx%d]" % (_g_dw, _g_dh)
-    if not fileExists('/tmp/dw.info'):
-        os.system('touch /tmp/dw.info')
-    os.system('chmod 755 /tmp/dw.info')
-    open("/tmp/dw.info", "w").write(str(_g_dw) + "x" + str(_g_dh))
+    try:
+        with open("/tmp/dw.info", "w") as f:
+            f.write(str(_g_dw) + "x" + str(_g_dh))
+        os.chmod("/tmp/dw.info", 0755)
+    except (IOError, OSError) as e:
+        print "[XBMC] cannot save desktop size: %s" % str(e)
 
 
-SaveDesktopInfo()
+DESKTOP_HD = None
 
 
 def esHD():
-    if getDesktop(0).size().width() > 1400:
-        return True
-    else:
-        return False
+    global DESKTOP_HD
+    if DESKTOP_HD is None:
+        DESKTOP_HD = getDesktop(0).size().width() > 1400
+    return DESKTOP_HD
 
 
 def fhd(num, factor=1.5):
@@ -222,6 +388,45 @@ def fhd(num, factor=1.5):
     return int(round(prod))
 
 
+def getPlayerArtworkSize():
+    # size of the "image" widget in the KodiVideoPlayer skins
+    return (fhd(200), fhd(200))
+
+
+def getInfoArtworkSize():
+    # size of the "image" widget in the VideoInfoView skins
+    if esHD():
+        return (300, 400)
+    return (200, 266)
+
+
+def getArtworkCacheSettings():
+    # the artwork cache keeps copies scaled to the widget sizes
+    return {
+        "cachedir": config.plugins.kodi.artworkCacheDir.value,
+        "maxBytes": config.plugins.kodi.artworkCacheSize.value * 1024 * 1024,
+        "variantSizes": (getPlayerArtworkSize(), getInfoArtworkSize())}
+
+
+# read when the artwork is needed for the first time
+setupArtworkCache(getArtworkCacheSettings)
+
+
+TIMESLEEP = None
+
+
+def getTimeSleep():
+    """Returns timesleep() of the TimeSleep plugin or None if it's not installed"""
+    global TIMESLEEP
+    if TIMESLEEP is None:
+        try:
+            from Plugins.Extensions.TimeSleep.plugin import timesleep
+        except Exception:
+            timesleep = False
+        TIMESLEEP = timesleep
+    return TIMESLEEP or None
+
+
 def FBLock():
     print"[KodiLauncher] FBLock"
     fbClass.getInstance().lock()
@@ -244,18 +449,33 @@ def RCUnlock():
 
 def kodiStopped(data, retval, extraArgs):
     print '[KodiLauncher] kodi stopped: retval = %d' % retval
+    # the user quitting Kodi doesn't want it back in the background
+    if config.plugins.kodi.standby.value and retval not in KODI_EXIT_CODES:
+        print '[KodiLauncher] kodi crashed, restarting it in standby'
+        getKodiStandby().schedule(STANDBY_RESTART_DELAY)
 
 
 def kodiResumeStopped(data, retval, extraArgs):
     print '[KodiLauncher] kodi resume script stopped: retval = %d' % retval
     if retval > 0:
+        stopLauncher()
+
+
+def stopLauncher():
+    # Kodi may also switch to enigma2 while no launcher is open,
+    # e.g. when the standby Kodi is hidden
+    if KODI_LAUNCHER is not None:
         KODI_LAUNCHER.stop()
+
+
+def launcherClosed():
+    global KODI_LAUNCHER
+    KODI_LAUNCHER = None
 #        <eLabel name="" position="1400,1020" size="445,45" text=" " font="RegularHD; 20"  backgroundColor="#001E1C1C"/>
 
 
 class KodiVideoPlayer(InfoBarBase, InfoBarShowHide, SubsSupportStatus, SubsSupport, InfoBarSeek, InfoBarSubservicesSupport, InfoBarAspectChange, InfoBarAudioSelection, InfoBarNotifications, HelpableScreen, Screen):
-    if esHD():
-        skin = """
+    SKIN_FHD = """
         <screen title="custom service source" position="0, 0" size="1921,1081" zPosition="1" flags="wfNoBorder" backgroundColor="transparent">
 	    <widget source="global.CurrentTime" render="Label" position="1700,34" size="150,67" font="RegularHD; 32" backgroundColor="#10000000" transparent="1" zPosition="3" halign="center">
 	      <convert type="ClockToText">Default</convert>
@@ -315,8 +535,7 @@ class KodiVideoPlayer(InfoBarBase, InfoBarShowHide, SubsSupportStatus, SubsSuppo
     		<convert type="ConditionalShowHide" />
 	</widget>
 	</screen>"""
-    else:
-        skin = """
+    SKIN_HD = """
         <screen title="custom service source" position="0, 0" size="1280,720" zPosition="1" flags="wfNoBorder" backgroundColor="transparent">
 	    <widget source="global.CurrentTime" render="Label" position="1133,22" size="100,44" font="Regular; 32" backgroundColor="#10000000" transparent="1" zPosition="3" halign="center">
 	      <convert type="ClockToText">Default</convert>
@@ -381,6 +600,7 @@ class KodiVideoPlayer(InfoBarBase, InfoBarShowHide, SubsSupportStatus, SubsSuppo
     instance = None
 
     def __init__(self, session, playlistCallback, nextItemCallback, prevItemCallback, infoCallback, menuCallback):
+        self.skin = esHD() and self.SKIN_FHD or self.SKIN_HD
         Screen.__init__(self, session)
         self.skinName = ['KodiVideoPlayer']
         statusScreen = self.session.instantiateDialog(StatusScreen)
@@ -402,32 +622,29 @@ class KodiVideoPlayer(InfoBarBase, InfoBarShowHide, SubsSupportStatus, SubsSuppo
         self.statusScreen = statusScreen
         self.defaultImage = None
         self.postAspectChange.append(self.showAspectChanged)
-        self.__timer = eTimer()
-        self.__timer.callback.append(self.__seekToPosition)
+        self.__resumeSeek = PendingSeek(session, self.__seekToPosition,
+                config.plugins.kodi.resumeTimeout.value * 1000)
         self.__image = None
         self.__position = None
         self.__firstStart = True
+        self.onPlayStatusChanged = []
 	self["genre"] = Label()
 
-        # load meta info from json file provided by Kodi Enigma2Player
-        try:
-            meta = json.load(open(KODIEXTIN, "r"))
-        except Exception as e:
-            self.logger.error("failed to load meta from %s: %s", KODIEXTIN, str(e))
-            meta = {}
-	self.__image = Meta(meta).getImage()
+        # meta info from json file provided by Kodi Enigma2Player
+        meta = META_CACHE.load()
+        self.__image = meta.getImage()
         self["image"] = WebPixmap(self.__image, caching=True)
 
-	self.genre = str(", ".join(Meta(meta).getGenre()))
-	self.plot = Meta(meta).getPlot()
+        self.genre = toString(u", ".join(meta.getGenre()))
+        self.plot = meta.getPlot()
 
-	self["genre"].setText(self.genre)
+        self["genre"].setText(self.genre)
 
         # set title, image if provided
-        self.title_ref = Meta(meta).getTitle()
+        self.title_ref = meta.getTitle()
 
         # set start position if provided
-        self.setStartPosition(Meta(meta).getStartTime())
+        self.setStartPosition(meta.getStartTime())
 
         self["directionActions"] = HelpableActionMap(self, "DirectionActions",
         {
@@ -453,6 +670,7 @@ class KodiVideoPlayer(InfoBarBase, InfoBarShowHide, SubsSupportStatus, SubsSuppo
         self.eventTracker = ServiceEventTracker(self,
         {
             iPlayableService.evStart: self.__evStart,
+            iPlayableService.evSeekableStatusChanged: self.__evSeekableStatusChanged,
         })
 
 	assert KodiVideoPlayer.instance is None, "class KodiVideoPlayer is a singleton class and just one instance of this class is allowed!"
@@ -460,12 +678,12 @@ class KodiVideoPlayer(InfoBarBase, InfoBarShowHide, SubsSupportStatus, SubsSuppo
 
         self.onClose.append(boundFunction(self.session.deleteDialog, self.statusScreen))
         self.onClose.append(boundFunction(Notifications.RemovePopup, self.RESUME_POPUP_ID))
-        self.onClose.append(self.__timer.stop)
+        self.onClose.append(self.__resumeSeek.stop)
 
     def keyr(self):
 	try:
-		if fileExists("/usr/lib/enigma2/python/Plugins/Extensions/TimeSleep/plugin.pyo") or fileExists("/usr/lib/enigma2/python/Plugins/Extensions/TimeSleep/plugin.so"):
-			from Plugins.Extensions.TimeSleep.plugin import timesleep
+		timesleep = getTimeSleep()
+		if timesleep is not None:
 			timesleep(self, True)
 		else:
 			InfoBarSeek.seekFwdManual(self)
@@ -474,8 +692,8 @@ class KodiVideoPlayer(InfoBarBase, InfoBarShowHide, SubsSupportStatus, SubsSuppo
 
     def keyl(self):
 	try:
-		if fileExists("/usr/lib/enigma2/python/Plugins/Extensions/TimeSleep/plugin.pyo") or fileExists("/usr/lib/enigma2/python/Plugins/Extensions/TimeSleep/plugin.so"):
-			from Plugins.Extensions.TimeSleep.plugin import timesleep
+		timesleep = getTimeSleep()
+		if timesleep is not None:
 			timesleep(self, False)
 		else:
 			InfoBarSeek.seekBackManual(self)
@@ -483,19 +701,42 @@ class KodiVideoPlayer(InfoBarBase, InfoBarShowHide, SubsSupportStatus, SubsSuppo
 		InfoBarSeek.seekBackManual(self)
 
     def __evStart(self):
+        self.playStatusChanged()
         if self.__position and self.__firstStart:
             self.__firstStart = False
             Notifications.AddNotificationWithID(self.RESUME_POPUP_ID,
                     MessageBox, _("Resuming playback"), timeout=0,
                     type=MessageBox.TYPE_INFO, enable_input=True)
-            self.__timer.start(500, True)
+            self.__resumeSeek.start()
 
-    def __seekToPosition(self):
-        if getPlayPositionInSeconds(self.session) is None:
-            self.__timer.start(500, True)
-        else:
-            Notifications.RemovePopup(self.RESUME_POPUP_ID)
+    def __evSeekableStatusChanged(self):
+        self.playStatusChanged()
+        self.__resumeSeek.serviceEvent()
+
+    def __seekToPosition(self, seekable):
+        Notifications.RemovePopup(self.RESUME_POPUP_ID)
+        if seekable:
             self.doSeek(long(self.__position))
+        else:
+            Notifications.AddNotification(MessageBox,
+                    _("Could not resume playback, playing from the beginning"),
+                    type=MessageBox.TYPE_INFO, timeout=5)
+
+    def playStatusChanged(self):
+        for f in self.onPlayStatusChanged:
+            f()
+
+    def setSeekState(self, state):
+        InfoBarSeek.setSeekState(self, state)
+        self.playStatusChanged()
+
+    def doSeek(self, pts):
+        InfoBarSeek.doSeek(self, pts)
+        self.playStatusChanged()
+
+    def doSeekRelative(self, pts):
+        InfoBarSeek.doSeekRelative(self, pts)
+        self.playStatusChanged()
 
     def setImage(self, image):
         self.__image = image
@@ -529,10 +770,23 @@ class KodiVideoPlayer(InfoBarBase, InfoBarShowHide, SubsSupportStatus, SubsSuppo
         self.close()
 
 
+def memoized(method):
+    def wrapper(self):
+        try:
+            return self.memo[method.__name__]
+        except KeyError:
+            value = self.memo[method.__name__] = method(self)
+            return value
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
 class Meta(object):
     def __init__(self, meta):
         self.meta = meta
+        self.memo = {}
 
+    @memoized
     def getTitle(self):
         title = u""
         vTag = self.meta.get('videoInfoTag')
@@ -561,17 +815,10 @@ class Meta(object):
                     title += u" (" + str(year) + u")"
         if not title:
             title = self.meta.get("title")
-	filename = self.getFilename()
-	if not title and fileExists(str(filename) + ".spztxt"):
-		f = open(str(filename) + ".spztxt", "r")
-		tok = 0
-		for line in f.readlines():
-			idx = line.find("->")
-			if idx != -1:
-				if tok == 0:
-					title = u'' + line[idx + 3:]
-					break
-		f.close()
+        if not title:
+            spzTxt = self.getSpzTxt()
+            if spzTxt is not None and spzTxt.title:
+                title = spzTxt.title
         if not title:
             listItem = self.meta.get("listItem")
             if listItem:
@@ -585,6 +832,7 @@ class Meta(object):
             startTime = playerOptions.get("startTime", 0)
         return startTime
 
+    @memoized
     def getImage(self):
 	image = None
 	listItem = self.meta.get("listItem")
@@ -600,61 +848,95 @@ class Meta(object):
 				image = imageweb
 		else:
 			filename = self.getFilename()
-			if fileExists(str(filename) + ".png"):
-				image = str(filename) + ".png"
-			elif fileExists(str(filename) + ".gif"):
-				image = str(filename) + ".gif"
-			elif fileExists(str(filename) + ".jpg"):
-				image = str(filename) + ".jpg"
+			if filename:
+				# artwork next to local media, from the directory index
+				sidecar = DIRECTORY_INDEX.findSidecar(toString(filename), (".png", ".gif", ".jpg"))
+				if sidecar is not None:
+					image = sidecar
 	return image
 
     def getFilename(self):
 	return self.meta.get("strPath")
 
+    @memoized
+    def getSpzTxt(self):
+        # .spztxt sidecar of local media, parsed once and cached
+        filename = self.getFilename()
+        if filename:
+            return SPZTXT_CACHE.get(toString(filename) + ".spztxt")
+
+    @memoized
     def getPlot(self):
 	plot = u''
         vTag = self.meta.get('videoInfoTag')
         if vTag and vTag.get("plot"):
 		plot = u'' + vTag.get("plot")
 
-	filename = self.getFilename()
-	if not plot and fileExists(str(filename) + ".spztxt"):
-		f = open(str(filename) + ".spztxt", "r")
-		tok = 0
-		for line in f.readlines():
-			idx = line.find("->")
-			if idx != -1:
-				if tok == 0:
-					tok = 1
-				elif tok == 1:
-					plot = u'' + line[idx + 3:]
-					break
-		f.close()
+	if not plot:
+		spzTxt = self.getSpzTxt()
+		if spzTxt is not None:
+			plot = spzTxt.plot
 
 	return plot
 
+    @memoized
     def getGenre(self):
 	genre = []
         vTag = self.meta.get('videoInfoTag')
         if vTag and vTag.get("genre"):
 		genre = vTag.get("genre")
 
-	filename = self.getFilename()
-	if not genre and fileExists(str(filename) + ".spztxt"):
-		f = open(str(filename) + ".spztxt", "r")
-		for line in f.readlines():
-			if line.split(":")[0] == 'Género':
-				genrestr = u'' + line.split(":")[1][1:]
-				genre = genrestr.split(" | ")
-				break
-		f.close()
+	if not genre:
+		spzTxt = self.getSpzTxt()
+		if spzTxt is not None:
+			genre = spzTxt.genre
 
 	return genre
 
 
+class MetaCache(object):
+    """
+    Meta of the json file provided by Kodi Enigma2Player, the file is
+    parsed again only when its path, mtime or size changes
+    """
+
+    def __init__(self, path):
+        self.logger = logging.getLogger('MetaCache')
+        self.path = path
+        self.key = None
+        self.parsed = self.meta = Meta({})
+
+    def load(self, playData=None):
+        # playData of a play request, to check that meta belongs to it
+        try:
+            st = os.stat(self.path)
+            key = (self.path, st.st_mtime, st.st_size)
+        except OSError as e:
+            self.logger.error("failed to load meta from %s: %s", self.path, str(e))
+            key = None
+        if key != self.key:
+            self.key = key
+            self.parsed = self.meta = Meta({})
+            if key is not None:
+                try:
+                    self.parsed = self.meta = Meta(json.load(open(self.path, "r")))
+                except Exception as e:
+                    self.logger.error("failed to load meta from %s: %s", self.path, str(e))
+        if playData is not None:
+            strPath = self.parsed.getFilename()
+            if strPath and strPath not in playData:
+                self.logger.error("meta data for another filepath?")
+                self.meta = Meta({})
+            else:
+                self.meta = self.parsed
+        return self.meta
+
+
+META_CACHE = MetaCache(KODIEXTIN)
+
+
 class VideoInfoView(Screen):
-	if esHD():
-		skin = """
+	SKIN_FHD = """
 		<screen position="center,center" size="1150,600" title="View Video Info" >
                    <widget name="image" position="15,150" size="300,400" alphatest="on" transparent="1"/>
                    <widget source="session.CurrentService" render="Label" position="20,20" size="1110,42" zPosition="1"  font="RegularHD;26" valign="center" halign="left" foregroundColor="#00ffa533" transparent="1">
@@ -664,8 +946,7 @@ class VideoInfoView(Screen):
                    <eLabel name="linea" position="20,110" size="1110,2" foregroundColor="#40444444" transparent="0" zPosition="20" backgroundColor="#30555555"/>
 		   <widget source="description" position="330,150" size="800,400" font="RegularHD; 20" render="RunningTextSpa" options="movetype=swimming,startpoint=0,direction=top,steptime=100,repeat=0,always=0,oneshot=0,startdelay=15000,pause=500,backtime=5" noWrap="0"/>
 		</screen>"""
-	else:
-		skin = """
+	SKIN_HD = """
 		<screen position="center,center" size="766,400" title="View Video Info" >
                    <widget name="image" position="10,100" size="200,266" alphatest="on" transparent="1"/>
                    <widget source="session.CurrentService" render="Label" position="13,13" size="740,28" zPosition="1"  font="Regular;26" valign="center" halign="left" foregroundColor="#00ffa533" transparent="1">
@@ -677,22 +958,18 @@ class VideoInfoView(Screen):
 		</screen>"""
 
 	def __init__(self, session):
-		self.skin = VideoInfoView.skin
+		self.skin = esHD() and VideoInfoView.SKIN_FHD or VideoInfoView.SKIN_HD
 		Screen.__init__(self, session)
 
 		self["genre"] = Label()
 		self["description"] = Label()
-	        # load meta info from json file provided by Kodi Enigma2Player
-	        try:
-	            meta = json.load(open(KODIEXTIN, "r"))
-	        except Exception as e:
-	            self.logger.error("failed to load meta from %s: %s", KODIEXTIN, str(e))
-	            meta = {}
-		self.__image = Meta(meta).getImage()
-	        self["image"] = WebPixmap(self.__image, caching=True)
-
-		self.genre = str(", ".join(Meta(meta).getGenre()))
-		self.plot = str(Meta(meta).getPlot())
+		# meta info from json file provided by Kodi Enigma2Player
+		meta = META_CACHE.load()
+		self.__image = meta.getImage()
+		self["image"] = WebPixmap(self.__image, caching=True)
+
+		self.genre = toString(u", ".join(meta.getGenre()))
+		self.plot = toString(meta.getPlot())
 
 		self["genre"].setText(self.genre)
 		self["description"].setText(self.plot)
@@ -704,12 +981,64 @@ class VideoInfoView(Screen):
 		}, -1)
 
 
+# immutable play status snapshot, payload is the OP_CODE_PLAY_STATUS reply data
+PlayStatus = namedtuple('PlayStatus', 'playing position duration paused payload')
+
+
 class E2KodiExtRequestHandler(KodiExtRequestHandler):
+    SESSION_OPCODES = (OP_CODE_PLAY_STATUS_SUBSCRIBE,)
+
+    def setup(self):
+        # requests waiting for this connection to be closed
+        self.closingRequests = []
 
     def handle_request(self, opcode, status, data):
-        self.server.messageOut.put((status, data))
-        self.server.messagePump.send(opcode)
-        return self.server.messageIn.get()
+        if opcode == OP_CODE_PLAY_STATUS:
+            # answered from the snapshot, no main loop round trip
+            playStatus = self.server.playStatus
+            return playStatus.playing, playStatus.payload
+        if opcode == OP_CODE_PLAY_STATUS_SUBSCRIBE:
+            return self.handle_subscribe(data)
+        if opcode == OP_CODE_STATS:
+            report = self.server.stats.report(OP_CODE_NAMES)
+            report["plugin"] = {"import_ms": round(IMPORT_DURATION * 1000, 1)}
+            return True, json.dumps(report, indent=2, sort_keys=True)
+        request = PendingRequest(opcode, status, data)
+        self.server.submitRequest(request)
+        result = request.wait(REQUEST_TIMEOUTS.get(opcode, REQUEST_TIMEOUT))
+        if request.closedCallbacks:
+            self.closingRequests.append(request)
+        return result
+
+    def connection_closed(self):
+        for request in self.closingRequests:
+            for callback in request.closedCallbacks:
+                self.server.submitCall(callback)
+
+    def handle_subscribe(self, data):
+        # push OP_CODE_PLAY_STATUS frames on every play state change and
+        # every interval ms (0 = state changes only) until the player is
+        # closed, the final frame (status False) is the subscribe reply
+        try:
+            interval = int(data) / 1000.0 or None
+        except (TypeError, ValueError):
+            interval = 1.0
+        subscription = self.server.subscribe()
+        try:
+            playStatus = self.server.playStatus
+            while playStatus.playing:
+                self.send_reply(OP_CODE_PLAY_STATUS, playStatus.playing, playStatus.payload)
+                try:
+                    playStatus = subscription.get(True, interval)
+                except Empty:
+                    playStatus = self.server.playStatus
+                else:
+                    # only the latest play state is of interest
+                    while not subscription.empty():
+                        playStatus = subscription.get_nowait()
+        finally:
+            self.server.unsubscribe(subscription)
+        return playStatus.playing, playStatus.payload
 
 
 class E2KodiExtServer(UDSServer):
@@ -717,75 +1046,183 @@ class E2KodiExtServer(UDSServer):
         UDSServer.__init__(self, KODIEXT_SOCKET, E2KodiExtRequestHandler)
         self.kodiPlayer = None
         self.subtitles = []
-        self.messageIn = Queue()
-        self.messageOut = Queue()
+        self.pendingRequests = []
+        self.pendingCalls = []
+        self.pendingLock = threading.Lock()
         self.messagePump = ePythonMessagePump()
         self.messagePump.recv_msg.get().append(self.messageReceived)
+        self.subscribers = []
+        self.subscribersLock = threading.Lock()
+        self.playStatus = self.getPlayStatus()
+        self.playStatusTimer = eTimer()
+        self.playStatusTimer.callback.append(self.updatePlayStatus)
+        self.kodiThrottle = ProcessThrottle()
+        self.stopTimer = eTimer()
+        self.stopTimer.callback.append(stopLauncher)
 
     def shutdown(self):
         self.messagePump.stop()
         self.messagePump = None
         UDSServer.shutdown(self)
 
-    def messageReceived(self, opcode):
-        status, data = self.messageOut.get()
+    def submitRequest(self, request):
+        # wake up the main loop only for the first request of a burst,
+        # the following ones are handled in the same wakeup
+        with self.pendingLock:
+            wakeup = not self.pendingRequests and not self.pendingCalls
+            self.pendingRequests.append(request)
+        if wakeup:
+            self.messagePump.send(0)
+
+    def submitCall(self, callback):
+        # run callback on the main loop
+        with self.pendingLock:
+            wakeup = not self.pendingRequests and not self.pendingCalls
+            self.pendingCalls.append(callback)
+        if wakeup:
+            self.messagePump.send(0)
+
+    def messageReceived(self, _):
+        with self.pendingLock:
+            requests, self.pendingRequests = self.pendingRequests, []
+            calls, self.pendingCalls = self.pendingCalls, []
+        for request in requests:
+            started = time.time()
+            self.stats.time(request.opcode, 'queue_wait', started - request.created)
+            if request.cancelled:
+                # the client got its timeout already, acting on a late
+                # PLAY or SWITCH now would surprise the user
+                self.logger.error("messageReceived: request %d (opcode = %d) timed out while queued, skipping", request.id, request.opcode)
+                self.stats.count(request.opcode, 'skipped')
+                continue
+            try:
+                self.handleRequest(request)
+            except Exception:
+                # don't leave the rest of the burst unanswered
+                self.logger.exception("messageReceived: request %d (opcode = %d) failed", request.id, request.opcode)
+                self.stats.count(request.opcode, 'errors')
+                request.reply(False)
+            self.stats.time(request.opcode, 'handler', time.time() - started)
+        for callback in calls:
+            try:
+                callback()
+            except Exception:
+                self.logger.exception("messageReceived: callback %r failed", callback)
+
+    def handleRequest(self, request):
+        opcode = request.opcode
         if opcode == OP_CODE_EXIT:
-            self.handleExitMessage(status, data)
+            self.handleExitMessage(request)
         elif opcode == OP_CODE_PLAY:
-            self.handlePlayMessage(status, data)
-        elif opcode == OP_CODE_PLAY_STATUS:
-            self.handlePlayStatusMessage(status, data)
+            self.handlePlayMessage(request)
         elif opcode == OP_CODE_PLAY_STOP:
-            self.handlePlayStopMessage(status, data)
+            self.handlePlayStopMessage(request)
         elif opcode == OP_CODE_SWITCH_TO_ENIGMA2:
-            self.handleSwitchToEnigma2Message(status, data)
+            self.handleSwitchToEnigma2Message(request)
         elif opcode == OP_CODE_SWITCH_TO_KODI:
-            self.handleSwitchToKodiMessage(status, data)
-
-    def handleExitMessage(self, status, data):
-        self.messageIn.put((True, None))
-        self.stopTimer = eTimer()
-        self.stopTimer.callback.append(KODI_LAUNCHER.stop)
-        self.stopTimer.start(500, True)
-
-    def handlePlayStatusMessage(self, status, data):
-        position = getPlayPositionInSeconds(SESSION)
-        duration = getDurationInSeconds(SESSION)
-        if position and duration:
-            # decoder sometimes provides invalid position after seeking
-            if position > duration:
-                position = None
+            self.handleSwitchToKodiMessage(request)
+        elif opcode == OP_CODE_PREFETCH:
+            self.handlePrefetchMessage(request)
+        else:
+            self.logger.error("handleRequest: unknown opcode %d", opcode)
+            request.reply(False)
+
+    def handleExitMessage(self, request):
+        self.stopLauncherWhenClosed(request)
+        request.reply(True)
+
+    def stopLauncherWhenClosed(self, request):
+        # the client closes the connection once it's done with its part
+        # of the switch, e.g. hiding Kodi, the timer is only a fallback
+        # for clients which keep it open
+        self.stopTimer.start(STOP_LAUNCHER_TIMEOUT, True)
+        request.closedCallbacks.append(self.connectionClosed)
+
+    def connectionClosed(self):
+        if self.stopTimer.isActive():
+            self.stopTimer.stop()
+            stopLauncher()
+
+    def subscribe(self):
+        subscription = Queue()
+        with self.subscribersLock:
+            self.subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.subscribersLock:
+            self.subscribers.remove(subscription)
+
+    def getPlayStatus(self):
+        position = duration = None
+        paused = False
+        if self.kodiPlayer is not None:
+            position = getPlayPositionInSeconds(SESSION)
+            duration = getDurationInSeconds(SESSION)
+            if position and duration:
+                # decoder sometimes provides invalid position after seeking
+                if position > duration:
+                    position = None
+            paused = self.kodiPlayer.seekstate == InfoBarSeek.SEEK_STATE_PAUSE
         statusMessage = {
             "duration": duration,
+            "paused": paused,
             "playing": self.kodiPlayer is not None,
             "position": position}
-        self.messageIn.put((self.kodiPlayer is not None, json.dumps(statusMessage)))
-
-    def handlePlayStopMessage(self, status, data):
+        return PlayStatus(self.kodiPlayer is not None, position, duration, paused, json.dumps(statusMessage))
+
+    def updatePlayStatus(self):
+        # the snapshot is replaced, never modified, so the server
+        # threads read it without locking
+        self.playStatus = self.getPlayStatus()
+        return self.playStatus
+
+    def publishPlayStatus(self):
+        playStatus = self.updatePlayStatus()
+        with self.subscribersLock:
+            subscribers = self.subscribers[:]
+        for subscription in subscribers:
+            subscription.put(playStatus)
+
+    def handlePlayStopMessage(self, request):
         FBLock()
         RCLock()
-        self.messageIn.put((True, None))
+        request.reply(True)
 
-    def handleSwitchToEnigma2Message(self, status, data):
-        self.messageIn.put((True, None))
-        self.stopTimer = eTimer()
-        self.stopTimer.callback.append(KODI_LAUNCHER.stop)
-        self.stopTimer.start(500, True)
+    def handleSwitchToEnigma2Message(self, request):
+        self.stopLauncherWhenClosed(request)
+        request.reply(True)
+
+    def handleSwitchToKodiMessage(self, request):
+        request.reply(True)
 
-    def handleSwitchToKodiMessage(self, status, data):
-        self.messageIn.put((True, None))
+    def handlePrefetchMessage(self, request):
+        # artwork urls of upcoming items, one per line
+        for url in (request.data or "").split("\n"):
+            url = url.strip()
+            if url:
+                prefetchArtwork(url, getPlayerArtworkSize())
+        request.reply(True)
 
-    def handlePlayMessage(self, status, data):
+    def handlePlayMessage(self, request):
+        data = request.data
         if data is None:
             self.logger.error("handlePlayMessage: no data!")
-            self.messageIn.put((False, None))
+            request.reply(False)
             return
         FBUnlock()
         RCUnlock()
 
-        setaudio.switch(False, True)
-        if getMachineBrand() not in ('Vu+', 'Formuler'):
-            setresolution.switch(False, True)
+        # load meta info from json file provided by Kodi Enigma2Player,
+        # the player screens get the same Meta from the cache
+        meta = META_CACHE.load(data)
+        # fetch the player artwork while the video output is switched,
+        # the player's WebPixmap decodes it itself right after
+        prefetchArtwork(meta.getImage(), getPlayerArtworkSize(), decode=False)
+
+        getSetAudio().switch(False, True)
+        if getMachineBrand() not in ('Vu+', 'Formuler') and not config.plugins.kodi.keepKodiMode.value:
+            getSetResolution().switch(False, True)
         # parse subtitles, play path and service type from data
         sType = 4097
         subtitles = []
@@ -811,21 +1248,13 @@ class E2KodiExtServer(UDSServer):
         for idx, subtitlesPath in enumerate(subtitles):
             self.logger.debug("handlePlayMessage: subtitlesPath[%d] = %s", idx, subtitlesPath)
 
-        # load meta info from json file provided by Kodi Enigma2Player
-        try:
-            meta = json.load(open(KODIEXTIN, "r"))
-        except Exception as e:
-            self.logger.error("failed to load meta from %s: %s", KODIEXTIN, str(e))
-            meta = {}
-        else:
-            if meta.get("strPath") and meta["strPath"] not in data:
-                self.logger.error("meta data for another filepath?")
-                meta = {}
-
         # create Kodi player Screen
         noneFnc = lambda: None
         self.kodiPlayer = SESSION.openWithCallback(self.kodiPlayerExitCB, KodiVideoPlayer,
             noneFnc, noneFnc, noneFnc, self.infoview, noneFnc)
+        self.kodiPlayer.onPlayStatusChanged.append(self.publishPlayStatus)
+        self.playStatusTimer.start(PLAY_STATUS_INTERVAL)
+        self.throttleKodi()
 
         # load subtitles
         if len(subtitles) > 0 and hasattr(self.kodiPlayer, "loadSubs"):
@@ -837,80 +1266,100 @@ class E2KodiExtServer(UDSServer):
         sref = eServiceReference(sType, 0, playPath)
 
         # set title, image if provided
-        title = Meta(meta).getTitle()
+        title = meta.getTitle()
         if not title:
             title = os.path.basename(playPath.split("#")[0])
         sref.setName(title.encode('utf-8'))
 
         # set start position if provided
-        #self.kodiPlayer.setStartPosition(Meta(meta).getStartTime())
+        #self.kodiPlayer.setStartPosition(meta.getStartTime())
 
         self.kodiPlayer.playService(sref)
-        self.messageIn.put((True, None))
+        # status requests following the reply must see the new player
+        self.updatePlayStatus()
+        request.reply(True)
+
+    def throttleKodi(self):
+        # Kodi keeps running behind the player, don't let it compete
+        # with the playback for CPU and IO
+        policy = config.plugins.kodi.throttle.value
+        if policy == "none":
+            return
+        pids = findProcesses("kodi.bin")
+        if policy == "nice":
+            self.kodiThrottle.nice(pids)
+        elif policy == "freeze":
+            self.kodiThrottle.freeze(pids)
 
     def kodiPlayerExitCB(self, callback=None):
-        setaudio.switch(True, True)
-        if getMachineBrand() not in ('Vu+', 'Formuler'):
-            setresolution.switch(True, True)
+        self.kodiThrottle.restore()
+        getSetAudio().switch(True, True)
+        if getMachineBrand() not in ('Vu+', 'Formuler') and not config.plugins.kodi.keepKodiMode.value:
+            getSetResolution().switch(True, True)
         SESSION.nav.stopService()
+        self.playStatusTimer.stop()
         self.kodiPlayer = None
         self.subtitles = []
+        self.publishPlayStatus()
 
     def infoview(self):
         SESSION.open(VideoInfoView)
 
 
 class KodiLauncher(Screen):
-    if esHD():
-        skin = """<screen position="fill" size="1920,1080" backgroundColor="#FF000000" flags="wfNoBorder" title=" "></screen>"""
-    else:
-        skin = """<screen position="fill" size="1280,720" backgroundColor="#FF000000" flags="wfNoBorder" title=" "></screen>"""
+    SKIN_FHD = """<screen position="fill" size="1920,1080" backgroundColor="#FF000000" flags="wfNoBorder" title=" "></screen>"""
+    SKIN_HD = """<screen position="fill" size="1280,720" backgroundColor="#FF000000" flags="wfNoBorder" title=" "></screen>"""
 
     def __init__(self, session):
+        self.skin = esHD() and self.SKIN_FHD or self.SKIN_HD
         Screen.__init__(self, session)
         RCLock()
         self.previousService = self.session.nav.getCurrentlyPlayingServiceReference()
         self.session.nav.stopService()
+        # start Kodi as soon as the launcher screen covers enigma2
         self.startupTimer = eTimer()
         self.startupTimer.timeout.get().append(self.startup)
-        self.startupTimer.start(500, True)
+        self.onShown.append(self.__onShown)
         self.onClose.append(RCUnlock)
+        self.onClose.append(launcherClosed)
+        if KODI_STANDBY is not None:
+            # the standby Kodi is about to be resumed, don't hide it
+            KODI_STANDBY.cancel()
 
-    def startup(self):
-        def psCallback(data, retval, extraArgs):
-            FBLock()
-            kodiProc = None
-            procs = data.split('\n')
-            if len(procs) > 0:
-                for p in procs:
-                    if 'kodi.bin' in p:
-                        if kodiProc is not None:
-                            print '[KodiLauncher] startup - there are more kodi processes running!'
-                            return self.stop()
-                        kodiProc = p.split()
-            if kodiProc is not None:
-                kodiPid = int(kodiProc[0])
-                print "[KodiLauncher] startup: kodi is running, pid = %d , resuming..." % kodiPid
-                self.resumeKodi(kodiPid)
-            else:
-                print "[KodiLauncher] startup: kodi is not running, starting..."
-                self.startKodi()
+    def __onShown(self):
+        self.onShown.remove(self.__onShown)
+        # after the main loop has painted the screen
+        self.startupTimer.start(0, True)
 
-        self._checkConsole = Console()
-        self._checkConsole.ePopen("ps | grep kodi.bin | grep -v grep", psCallback)
+    def startup(self):
+        FBLock()
+        pids = findProcesses("kodi.bin")
+        if len(pids) > 1:
+            print '[KodiLauncher] startup - there are %d kodi processes running, resuming the oldest one!' % len(pids)
+        if pids:
+            print "[KodiLauncher] startup: kodi is running, pid = %d , resuming..." % pids[0]
+            self.resumeKodi(pids[0])
+        else:
+            print "[KodiLauncher] startup: kodi is not running, starting..."
+            self.startKodi()
 
     def startKodi(self):
         self._startConsole = Console()
         self._startConsole.ePopen(KODIRUN_SCRIPT, kodiStopped)
 
     def resumeKodi(self, pid):
+        try:
+            # in case enigma2 restarted while Kodi was frozen
+            os.kill(pid, signal.SIGCONT)
+        except OSError:
+            pass
         self._resumeConsole = Console()
         self._resumeConsole.ePopen(KODIRESUME_SCRIPT % pid, kodiResumeStopped)
 
     def stop(self):
         FBUnlock()
-        setaudio.switch()
-        setresolution.switch()
+        getSetAudio().switch()
+        getSetResolution().switch()
         if self.previousService:
             self.session.nav.playService(self.previousService)
         try:
@@ -923,6 +1372,83 @@ class KodiLauncher(Screen):
         self.close()
 
 
+class KodiStandby(object):
+    """
+    Starts Kodi in the background and hides it, as Kodi does itself
+    when switching to enigma2, so that KodiLauncher resumes it instead
+    of a cold start. Kodi is started again after it has crashed, not
+    after the user quit it.
+    """
+
+    def __init__(self):
+        self.started = None
+        self.pid = None
+        self.polls = 0
+        self.startTimer = eTimer()
+        self.startTimer.callback.append(self.start)
+        self.pollTimer = eTimer()
+        self.pollTimer.callback.append(self.poll)
+        self.hideTimer = eTimer()
+        self.hideTimer.callback.append(self.hide)
+
+    def schedule(self, delay):
+        if config.plugins.kodi.standby.value:
+            self.startTimer.start(delay, True)
+
+    def start(self):
+        if KODI_LAUNCHER is not None or findProcesses("kodi.bin"):
+            return
+        print "[KodiStandby] starting kodi in background"
+        SaveDesktopInfo()
+        self.started = time.time()
+        self.pid = None
+        self.polls = 0
+        self._startConsole = Console()
+        self._startConsole.ePopen(KODIRUN_SCRIPT, self.stopped)
+        self.pollTimer.start(STANDBY_POLL_INTERVAL)
+
+    def poll(self):
+        pids = findProcesses("kodi.bin")
+        self.polls += 1
+        if pids:
+            self.pollTimer.stop()
+            self.pid = pids[0]
+            self.hide()
+            # kodi may show its window only once it's done with the splash
+            self.hideTimer.start(STANDBY_HIDE_AGAIN_DELAY, True)
+        elif self.polls * STANDBY_POLL_INTERVAL >= STANDBY_START_TIMEOUT:
+            print "[KodiStandby] kodi didn't start in %d ms" % STANDBY_START_TIMEOUT
+            self.pollTimer.stop()
+
+    def hide(self):
+        print "[KodiStandby] hiding kodi, pid = %d" % self.pid
+        self._hideConsole = Console()
+        self._hideConsole.ePopen(KODIHIDE_SCRIPT % self.pid)
+
+    def cancel(self):
+        # Kodi is going to be shown, standby ends here
+        self.startTimer.stop()
+        self.pollTimer.stop()
+        self.hideTimer.stop()
+        self.started = None
+
+    def stopped(self, data, retval, extraArgs):
+        if self.started is not None and time.time() - self.started < STANDBY_MIN_UPTIME:
+            # exited without being used, don't restart it over and over
+            print "[KodiStandby] kodi exited right after start: retval = %d" % retval
+            self.cancel()
+            return
+        self.started = None
+        kodiStopped(data, retval, extraArgs)
+
+
+def getKodiStandby():
+    global KODI_STANDBY
+    if KODI_STANDBY is None:
+        KODI_STANDBY = KodiStandby()
+    return KODI_STANDBY
+
+
 def autoStart(reason, **kwargs):
     print "[KodiLauncher] autoStart - reason = %d" % reason
     global SERVER_THREAD
@@ -935,15 +1461,20 @@ def autoStart(reason, **kwargs):
         SERVER = E2KodiExtServer()
         SERVER_THREAD = threading.Thread(target=SERVER.serve_forever)
         SERVER_THREAD.start()
+        # nothing to set up at boot unless the standby Kodi is enabled
+        if config.plugins.kodi.standby.value:
+            getKodiStandby().schedule(STANDBY_BOOT_DELAY)
     elif reason == 1:
+        SERVER.kodiThrottle.restore()
         SERVER.shutdown()
         SERVER_THREAD.join()
 
 
 def startLauncher(session, **kwargs):
-    setaudio.ReadData()
-    setaudio.switch(True)
-    setresolution.ReadData()
+    SaveDesktopInfo()
+    getSetAudio().ReadData()
+    getSetAudio().switch(True)
+    getSetResolution().ReadData()
     RCUnlock()
     global SESSION
     SESSION = session
@@ -962,3 +1493,7 @@ def Plugins(**kwargs):
             PluginDescriptor("Kodi", PluginDescriptor.WHERE_AUTOSTART, "Kodi Launcher", fnc=autoStart),
             PluginDescriptor("Kodi", PluginDescriptor.WHERE_EXTENSIONSMENU, "Kodi Launcher", fnc=startLauncher),
             PluginDescriptor("Kodi", PluginDescriptor.WHERE_PLUGINMENU, "Kodi Launcher", icon=kodiext, fnc=startLauncher)]
+
+
+# reported by OP_CODE_STATS
+IMPORT_DURATION = time.time() - IMPORT_STARTED
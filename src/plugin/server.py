@@ -1,7 +1,11 @@
 import os
 import logging
 import SocketServer
+import itertools
 import struct
+import threading
+import time
+from Queue import Queue
 
 try:
     loglevel = int(os.getenv("E2KODI_DEBUG_LVL", logging.ERROR))
@@ -12,39 +16,339 @@ print "E2KODI_DEBUG_LVL = ", loglevel
 logging.basicConfig(level=loglevel, format='%(name)s: %(message)s',)
 
 
+# protocol version 2 header, fixed little-endian layout:
+# magic, version, opcode, status, flags, data length, request id
+PROTOCOL_MAGIC = 'KEXT'
+PROTOCOL_VERSION = 2
+HEADER = struct.Struct('<4sBBbBII')
+
+# reply flags, version 2 only
+FLAG_ERROR = 0x01
+
+# protocol version 1 (legacy) header, native layout of the C
+# struct packet_header {int opcode; signed char result; int length;},
+# still accepted from older clients, kodiext itself needs version 2
+LEGACY_HEADER = struct.Struct('ibi')
+
+MAX_DATA_LENGTH = 1024 * 1024
+
+
+class RequestTimeout(Exception):
+    pass
+
+
+class LatencyHistogram(object):
+    """
+    Latency histogram with power of two millisecond buckets
+    """
+    BUCKETS = 12
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        idx = 0
+        while idx < self.BUCKETS - 1 and ms >= (1 << idx):
+            idx += 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def report(self):
+        # buckets as [upper bound in ms (None = unbounded), count]
+        buckets = []
+        for idx, count in enumerate(self.counts):
+            if count:
+                if idx < self.BUCKETS - 1:
+                    buckets.append([1 << idx, count])
+                else:
+                    buckets.append([None, count])
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count, 3),
+            "max_ms": round(self.max, 3),
+            "buckets": buckets}
+
+
+class RequestStats(object):
+    """
+    Per opcode counters and latency histograms
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, opcode, name, value=1):
+        key = (opcode, name)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def time(self, opcode, name, seconds):
+        key = (opcode, name)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def report(self, opcodeNames=None):
+        opcodeNames = opcodeNames or {}
+        report = {}
+        with self.lock:
+            for (opcode, name), value in self.counters.items():
+                report.setdefault(opcodeNames.get(opcode, str(opcode)), {})[name] = value
+            for (opcode, name), histogram in self.histograms.items():
+                report.setdefault(opcodeNames.get(opcode, str(opcode)), {})[name] = histogram.report()
+        return report
+
+
+class PendingRequest(object):
+    """
+    Request handed over to another thread, which answers it with reply()
+    while the request handler waits for the reply in wait()
+    """
+    ids = itertools.count(1)
+
+    def __init__(self, opcode, status, data):
+        self.logger = logging.getLogger('PendingRequest')
+        self.id = next(PendingRequest.ids)
+        self.created = time.time()
+        self.opcode = opcode
+        self.status = status
+        self.data = data
+        self.result = None
+        self.cancelled = False
+        self.event = threading.Event()
+        # called once the client has closed the connection
+        self.closedCallbacks = []
+
+    def reply(self, status, data=None):
+        if self.cancelled:
+            self.logger.error('reply()-> request %d (opcode = %d) timed out, dropping reply', self.id, self.opcode)
+            return
+        self.result = (status, data)
+        self.event.set()
+
+    def wait(self, timeout):
+        if not self.event.wait(timeout):
+            self.cancelled = True
+            raise RequestTimeout("no reply to request %d in %g seconds" % (self.id, timeout))
+        return self.result
+
+
 class KodiExtRequestHandler(SocketServer.BaseRequestHandler):
+    # opcodes of requests lasting a whole session, e.g. subscriptions,
+    # timed as 'session' so they don't skew the 'round_trip' latencies
+    SESSION_OPCODES = ()
 
     def __init__(self, request, client_address, server):
         self.logger = logging.getLogger('KodiExtRequestHandler')
+        self.buffer = bytearray(4096)
+        self.version = PROTOCOL_VERSION
+        self.requestId = 0
+        self.requestSize = 0
         SocketServer.BaseRequestHandler.__init__(self, request, client_address, server)
 
     def handle(self):
-        hlen = struct.calcsize('ibi')
-        header = self.request.recv(hlen)
-        opcode, status, datalen = struct.unpack('ibi', header)
+        # serve framed requests until the client closes the connection, so
+        # a client may keep one connection open for the whole session and
+        # pipeline its requests, while one-shot clients simply close after
+        # the first reply
+        try:
+            while True:
+                request = self.recv_request()
+                if request is None:
+                    self.logger.debug('recv()-> connection closed')
+                    break
+                opcode, status, data = request
+                self.logger.debug('recv()-> opcode = %d, status = %d, data = %s', opcode, status, str(data))
+                started = time.time()
+                stats = self.server.stats
+                stats.count(opcode, 'requests')
+                stats.count(opcode, 'bytes_in', self.requestSize)
+                try:
+                    status, data = self.handle_request(opcode, status, data)
+                except RequestTimeout as e:
+                    self.logger.error('handle_request()-> opcode = %d: %s', opcode, str(e))
+                    stats.count(opcode, 'timeouts')
+                    self.send_reply(opcode, False, str(e), FLAG_ERROR)
+                except Exception:
+                    stats.count(opcode, 'errors')
+                    raise
+                else:
+                    self.send_reply(opcode, status, data)
+                if opcode in self.SESSION_OPCODES:
+                    stats.time(opcode, 'session', time.time() - started)
+                else:
+                    stats.time(opcode, 'round_trip', time.time() - started)
+        finally:
+            self.connection_closed()
+
+    def recv_buffer(self, start, end):
+        # receive exactly buffer[start:end] from the client
+        if end > len(self.buffer):
+            buf = bytearray(max(end, 2 * len(self.buffer)))
+            buf[:start] = self.buffer[:start]
+            self.buffer = buf
+        view = memoryview(self.buffer)
+        while start < end:
+            n = self.request.recv_into(view[start:end], end - start)
+            if n == 0:
+                return False
+            start += n
+        return True
+
+    def recv_request(self):
+        # version 2 requests start with PROTOCOL_MAGIC, which can't be
+        # the beginning of a legacy header (opcode as native int)
+        if not self.recv_buffer(0, 4):
+            return None
+        if self.buffer[:4] == PROTOCOL_MAGIC:
+            if not self.recv_buffer(4, HEADER.size):
+                return None
+            magic, version, opcode, status, flags, datalen, self.requestId = HEADER.unpack_from(self.buffer)
+            self.version = min(version, PROTOCOL_VERSION)
+            headerSize = HEADER.size
+        else:
+            if not self.recv_buffer(4, LEGACY_HEADER.size):
+                return None
+            opcode, status, datalen = LEGACY_HEADER.unpack_from(self.buffer)
+            self.version = 1
+            self.requestId = 0
+            headerSize = LEGACY_HEADER.size
+        if datalen < 0 or datalen > MAX_DATA_LENGTH:
+            self.logger.error('recv()-> invalid data length %d, closing connection', datalen)
+            return None
+        self.requestSize = headerSize + datalen
         if datalen > 0:
-            data = self.request.recv(datalen)
+            if not self.recv_buffer(0, datalen):
+                return None
+            data = memoryview(self.buffer)[:datalen].tobytes()
         else:
             data = None
-        self.logger.debug('recv()-> opcode = %d, status = %d, data = %s', opcode, status, str(data))
-        status, data = self.handle_request(opcode, status, data)
+        return opcode, status, data
+
+    def send_reply(self, opcode, status, data, flags=0):
+        # handle_request() may also use this to push several frames
+        # to the client before returning the final reply
         if data is not None:
             datalen = len(data)
         else:
             datalen = 0
         self.logger.debug('send()-> opcode = %d, status = %d, data = %s', opcode, status, str(data))
-        header = struct.pack('ibi', opcode, status, datalen)
-        self.request.send(header)
+        if self.version >= 2:
+            header = HEADER.pack(PROTOCOL_MAGIC, self.version, opcode, status, flags, datalen, self.requestId)
+        else:
+            header = LEGACY_HEADER.pack(opcode, status, datalen)
+        # header and data in a single send
         if datalen > 0:
-            self.request.send(data)
+            header += data
+        self.request.sendall(header)
+        self.server.stats.count(opcode, 'bytes_out', len(header))
 
     def handle_request(self, opcode, status, data):
+        # raise RequestTimeout to send an error reply
         return True, None
 
+    def connection_closed(self):
+        # the client is done with all of its requests, e.g. a client
+        # which exits after its request has also finished its own work
+        pass
+
 
 class UDSServer(SocketServer.UnixStreamServer):
+    """
+    Serves each connection on one of max_workers worker threads
+
+    Clients keep their connection for the whole session and subscribed
+    ones hold it while playing, so a connection arriving while all
+    workers are busy is served on a thread of its own. Beyond
+    max_connections connections it's rejected with an error reply
+    instead of waiting for a worker which may never get free.
+    """
 
-    def __init__(self, server_address, handler_class=KodiExtRequestHandler):
+    def __init__(self, server_address, handler_class=KodiExtRequestHandler, max_workers=4, max_connections=32):
         self.logger = logging.getLogger('UDSServer')
         self.allow_reuse_address = True
         SocketServer.UnixStreamServer.__init__(self, server_address, handler_class)
+        self.stats = RequestStats()
+        self.connections = Queue()
+        self.max_connections = max_connections
+        self.lock = threading.Lock()
+        self.idle_workers = max_workers
+        # connections served outside of the workers
+        self.extra_connections = 0
+        self.workers = []
+        for idx in range(max_workers):
+            worker = threading.Thread(target=self.process_connections, name='UDSServer-%d' % idx)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            if self.idle_workers > 0:
+                self.idle_workers -= 1
+                self.connections.put((request, client_address))
+                return
+            accept = len(self.workers) + self.extra_connections < self.max_connections
+            if accept:
+                self.extra_connections += 1
+        if not accept:
+            self.reject_request(request, "server busy, %d connections open" % self.max_connections)
+            return
+        self.logger.debug('process_request()-> all workers busy, serving on an extra thread')
+        thread = threading.Thread(target=self.process_extra_connection, args=(request, client_address))
+        thread.daemon = True
+        thread.start()
+
+    def reject_request(self, request, message):
+        # the error answers the first request, read briefly so the
+        # client isn't still writing it when the connection is closed
+        self.logger.error('process_request()-> rejecting connection: %s', message)
+        opcode, requestId = 0, 0
+        try:
+            request.settimeout(1.0)
+            header = request.recv(HEADER.size)
+            if len(header) == HEADER.size and header[:4] == PROTOCOL_MAGIC:
+                opcode, requestId = HEADER.unpack(header)[2], HEADER.unpack(header)[6]
+            request.sendall(HEADER.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, opcode, 0, FLAG_ERROR, len(message), requestId) + message)
+        except Exception:
+            pass
+        self.shutdown_request(request)
+
+    def serve_connection(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def process_connections(self):
+        while True:
+            connection = self.connections.get()
+            if connection is None:
+                break
+            self.serve_connection(*connection)
+            with self.lock:
+                self.idle_workers += 1
+
+    def process_extra_connection(self, request, client_address):
+        try:
+            self.serve_connection(request, client_address)
+        finally:
+            with self.lock:
+                self.extra_connections -= 1
+
+    def shutdown(self):
+        SocketServer.UnixStreamServer.shutdown(self)
+        for worker in self.workers:
+            self.connections.put(None)
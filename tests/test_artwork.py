@@ -0,0 +1,157 @@
+# -*- coding: UTF-8 -*-
+# run with: trial tests
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "plugin"))
+
+from twisted.internet import defer, reactor
+from twisted.trial import unittest
+from twisted.web import resource, server
+
+import artwork
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ImageResource(resource.Resource):
+    """
+    Serves a fake image with an ETag after a short delay, /moved
+    redirects to it
+    """
+    isLeaf = True
+    ETAG = '"v1"'
+    DELAY = 0.05
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.requests = []
+        self.active = 0
+        self.maxActive = 0
+
+    def render_GET(self, request):
+        self.requests.append((request.path, request.getHeader('if-none-match')))
+        if request.path == '/moved':
+            request.redirect('/image')
+            return ''
+        if request.getHeader('if-none-match') == self.ETAG:
+            request.setResponseCode(304)
+            return ''
+        request.setHeader('ETag', self.ETAG)
+        self.active += 1
+        self.maxActive = max(self.maxActive, self.active)
+
+        def finish():
+            self.active -= 1
+            request.write('image data')
+            request.finish()
+        reactor.callLater(self.DELAY, finish)
+        return server.NOT_DONE_YET
+
+
+class ArtworkDownloaderTests(unittest.TestCase):
+
+    def setUp(self):
+        self.resource = ImageResource()
+        self.port = reactor.listenTCP(0, server.Site(self.resource), interface='127.0.0.1')
+        self.base = 'http://127.0.0.1:%d' % self.port.getHost().port
+        self.cache = artwork.ArtworkCache(self.mktemp(), maxAge=0)
+        self.downloader = artwork.ArtworkDownloader(self.cache, maxDownloads=2)
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @defer.inlineCallbacks
+    def test_coalescing(self):
+        url = self.base + '/image'
+        paths = yield defer.gatherResults([self.downloader.fetch(url) for i in range(3)])
+        self.assertEqual(len(self.resource.requests), 1)
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(self.read(paths[0]), 'image data')
+
+    @defer.inlineCallbacks
+    def test_maxDownloads(self):
+        yield defer.gatherResults([self.downloader.fetch('%s/image%d' % (self.base, i)) for i in range(5)])
+        self.assertEqual(len(self.resource.requests), 5)
+        self.assertEqual(self.resource.maxActive, 2)
+
+    @defer.inlineCallbacks
+    def test_revalidation(self):
+        url = self.base + '/image'
+        path = yield self.downloader.fetch(url)
+        self.assertEqual(self.cache.validators(url)[0], ImageResource.ETAG)
+        revalidated = yield self.downloader.fetch(url)
+        self.assertEqual(self.resource.requests[-1], ('/image', ImageResource.ETAG))
+        self.assertEqual(revalidated, path)
+        self.assertEqual(self.read(revalidated), 'image data')
+
+    @defer.inlineCallbacks
+    def test_redirect(self):
+        url = self.base + '/moved'
+        path = yield self.downloader.fetch(url)
+        self.assertEqual([p for p, etag in self.resource.requests], ['/moved', '/image'])
+        self.assertEqual(path, self.cache.get(url))
+        self.assertEqual(self.read(path), 'image data')
+
+
+class LargeImageResource(resource.Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        buf = io.BytesIO()
+        Image.new('RGB', (1280, 720), (200, 10, 10)).save(buf, 'JPEG')
+        return buf.getvalue()
+
+
+class ArtworkVariantTests(unittest.TestCase):
+
+    if Image is None:
+        skip = "PIL is not installed"
+
+    def setUp(self):
+        self.port = reactor.listenTCP(0, server.Site(LargeImageResource()), interface='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/image.jpg' % self.port.getHost().port
+        self.cachedir = self.mktemp()
+        self.cache = artwork.ArtworkCache(self.cachedir, variantSizes=[(300, 300)])
+        self.downloader = artwork.ArtworkDownloader(self.cache)
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    @defer.inlineCallbacks
+    def test_firstFetchGetsVariant(self):
+        path = yield self.downloader.fetch(self.url, (300, 300))
+        self.assertEqual(path, self.cache.path(self.cache.key(self.url), (300, 300)))
+        self.assertEqual(Image.open(path).size, (300, 168))
+
+    @defer.inlineCallbacks
+    def test_fetchWithoutSizeGetsOriginal(self):
+        path = yield self.downloader.fetch(self.url)
+        self.assertEqual(path, self.cache.path(self.cache.key(self.url)))
+        yield self.cache.whenScaled(self.url)
+
+    @defer.inlineCallbacks
+    def test_evictedWhileScaling(self):
+        path = yield self.downloader.fetch(self.url)
+        # the original is evicted before its variants are written
+        self.assertIn(self.cache.key(self.url), self.cache.scaling)
+        self.cache.maxEntries = 0
+        self.cache.insert('http://other/', self._tempFile())
+        yield self.cache.whenScaled(self.url)
+        key = self.cache.key(self.url)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual([name for name in os.listdir(self.cachedir) if name.startswith(key)], [])
+
+    def _tempFile(self):
+        path = self.cache.tempPath('http://other/')
+        with open(path, 'wb') as f:
+            f.write('other')
+        return path